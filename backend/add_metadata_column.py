@@ -3,21 +3,15 @@
 Add metadata column to sections table
 """
 
-from supabase import create_client
-from config import get_settings
+from database import column_exists
 
 def add_metadata_column():
-    settings = get_settings()
-    supabase = create_client(settings.supabase_url, settings.supabase_key)
-    
     try:
-        # First, let's check if the column exists by trying to select it
-        try:
-            result = supabase.table("sections").select("metadata").limit(1).execute()
+        # First, check information_schema for the column
+        if column_exists("sections", "metadata"):
             print("✅ Metadata column already exists")
             return True
-        except Exception:
-            print("📝 Metadata column doesn't exist, will create it...")
+        print("📝 Metadata column doesn't exist, will create it...")
         
         # Try to add the column using a simple approach
         # Note: Supabase might not allow direct DDL, so we'll handle this gracefully
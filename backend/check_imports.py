@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Backend smoke test: every backend module imports cleanly
+Catches errors evaluated at import time (bad annotations, missing names) before startup does.
+Run with `make test` or `python check_imports.py` from backend/
+"""
+
+import importlib
+import os
+import sys
+
+# Settings require these; nothing below contacts Supabase or Gemini at import time
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "smoke.test.key")
+os.environ.setdefault("GEMINI_API_KEY", "smoke-test")
+
+MODULES = (
+    "config",
+    "models",
+    "database",
+    "services.content_generator",
+    "services.file_processor",
+    "services.retrieval",
+    "services.background_tasks",
+    "services.latex_service_v2",
+    "main",
+)
+
+if __name__ == "__main__":
+    failed = 0
+    for module in MODULES:
+        try:
+            importlib.import_module(module)
+            print(f"✅ {module}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {module}: {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -6,6 +6,12 @@ class Settings(BaseSettings):
     # Supabase (can be local PostgreSQL or external Supabase)
     supabase_url: str
     supabase_key: str = ""  # Optional for local PostgreSQL
+    supabase_max_connections: int = 20
+    supabase_max_keepalive_connections: int = 10
+    supabase_keepalive_expiry: float = 30.0  # Seconds an idle pooled connection is kept open
+    supabase_http2: bool = True  # Multiplex requests over one TLS connection (needs httpx[http2])
+    supabase_timeout: float = 30.0  # Seconds per Supabase request (read/write/pool)
+    supabase_connect_timeout: float = 5.0
     
     # Gemini API (for text generation only)
     gemini_api_key: str
@@ -13,6 +19,10 @@ class Settings(BaseSettings):
     # Embedding model settings
     embedding_model: str = "all-MiniLM-L6-v2"
     embedding_dimension: int = 384
+    embedding_backend: str = "torch"  # "torch" or "onnx" (needs sentence-transformers[onnx])
+    embedding_onnx_file: str = "onnx/model_qint8_avx512_vnni.onnx"  # Quantized int8 weights
+    embed_device: str = "auto"  # "auto" picks CUDA when available, else "cpu"/"cuda"/"mps"
+    query_embedding_cache_size: int = 4096  # Memoized retrieval query embeddings
     
     # Application
     app_name: str = "IEEE Paper Generator"
@@ -22,20 +32,28 @@ class Settings(BaseSettings):
     max_file_size: int = 10 * 1024 * 1024  # 10MB
     allowed_extensions: list = [".pdf", ".docx"]
     upload_dir: str = "uploads"
+    file_processing_concurrency: int = 4  # Uploaded files parsed/embedded/stored in parallel
     
     # RAG settings
     chunk_size: int = 1000
     chunk_overlap: int = 200
     top_k_results: int = 5
+    max_context_chars: int = 24000  # Retrieved context per prompt (~6k tokens)
+    retrieval_cache_ttl: float = 300.0  # Seconds cached retrievals/corpora are reused (other workers' invalidations aren't seen)
     
     # Generation settings
     max_tokens: int = 8000  # Increased for longer content
     temperature: float = 0.7
+    generation_timeout: float = 120.0  # Hard cap (seconds) on a single Gemini generation call
+    api_check_ttl: float = 3600.0  # Seconds a successful Gemini connection test is trusted
+    gemini_requests_per_minute: int = 0  # Client-side Gemini request budget per worker process (0 = unlimited)
     
     # Content generation settings
     min_section_words: int = 800  # Minimum words per section
     target_paper_pages: int = 12  # Target paper length
     comprehensive_mode: bool = True  # Generate detailed content
+    section_generation_concurrency: int = 3  # Section batches generated in parallel
+    max_concurrent_papers: int = 4  # Complete-paper generations running at once
     
     class Config:
         env_file = ".env"
@@ -1,10 +1,87 @@
-from supabase import create_client, Client
+import random
+import time
+from functools import lru_cache
+from typing import Callable, TypeVar
+
+import httpx
+from supabase import create_client, Client, ClientOptions
 from config import get_settings
 
 settings = get_settings()
 
+T = TypeVar("T")
+
+# Transport failures where the request never reached the server, so even inserts can be resent
+_UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+def _http2_supported() -> bool:
+    """httpx needs the optional h2 package (httpx[http2]) for HTTP/2"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """Shared keep-alive HTTP connection pool for Supabase requests"""
+    return httpx.Client(
+        http2=settings.supabase_http2 and _http2_supported(),
+        # httpx defaults to 5s for everything, too short for bulk chunk inserts
+        timeout=httpx.Timeout(settings.supabase_timeout, connect=settings.supabase_connect_timeout),
+        limits=httpx.Limits(
+            max_connections=settings.supabase_max_connections,
+            max_keepalive_connections=settings.supabase_max_keepalive_connections,
+            keepalive_expiry=settings.supabase_keepalive_expiry
+        )
+    )
+
 def get_supabase_client() -> Client:
     """Get Supabase client instance"""
-    return create_client(settings.supabase_url, settings.supabase_key)
+    try:
+        options = ClientOptions(httpx_client=get_http_client())
+    except TypeError:
+        # Older supabase-py releases don't accept a custom httpx client
+        options = ClientOptions()
+    return create_client(settings.supabase_url, settings.supabase_key, options=options)
+
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """Get the shared Supabase client (usable as a FastAPI dependency)"""
+    return get_supabase_client()
+
+supabase: Client = get_supabase()
+
+@lru_cache(maxsize=None)
+def column_exists(table: str, column: str) -> bool:
+    """Check whether a column exists (cached for the life of the process)"""
+    try:
+        result = get_supabase().rpc("column_exists", {"tbl": table, "col": column}).execute()
+        return bool(result.data)
+    except Exception:
+        # Older databases without the column_exists function: fall back to probing the column
+        try:
+            get_supabase().table(table).select(column).limit(1).execute()
+            return True
+        except httpx.TransportError:
+            # Network failure says nothing about the schema; raise so the answer isn't cached
+            raise
+        except Exception:
+            return False
 
-supabase: Client = get_supabase_client()
+def retry_db(fn: Callable[[], T], retries: int = 3, base_delay: float = 0.25, idempotent: bool = False) -> T:
+    """Run a Supabase call, retrying transient connection failures with jittered exponential backoff
+    
+    Idempotent calls (updates, upserts) are retried on any transport error; other writes only
+    when the request never left the client, so a timed-out insert is never stored twice.
+    """
+    retryable = httpx.TransportError if idempotent else _UNSENT_REQUEST_ERRORS
+    for attempt in range(retries):
+        try:
+            return fn()
+        except retryable as e:
+            if attempt == retries - 1:
+                raise
+            delay = min(base_delay * 2 ** attempt, 4.0) * (0.5 + random.random())
+            print(f"⚠️  Supabase request failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            time.sleep(delay)
@@ -1,66 +1,221 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import uvicorn
+import asyncio
 import os
 import uuid
 import shutil
+import time
+import hashlib
+from collections import OrderedDict
 from pathlib import Path
-from typing import List
-import google.genai as genai
+from typing import List, Callable, TypeVar, Dict, Tuple, Optional
 import tempfile
 
 from models import (
     PaperCreate, PaperResponse, SectionCreate, SectionResponse,
     FileUploadResponse, GenerationRequest, GenerationResponse
 )
-from database import supabase
-from services.file_processor import FileProcessor
+from database import supabase, column_exists
+from services.file_processor import (
+    FileProcessor, get_file_processor, get_parse_executor, embed_query, compose_query_embedding
+)
 from services.latex_service_v2 import latex_service
-from services.background_tasks import background_task_manager
+from services.background_tasks import get_background_task_manager, COMPREHENSIVE_SECTIONS
+from services.content_generator import get_content_generator
+from services.retrieval import match_documents_cached, invalidate_paper_chunks, build_context
 
 from config import get_settings
 
 settings = get_settings()
 
+# Column projections matching the response models (avoid select("*") payloads)
+PAPER_COLUMNS = "paper_id,title,domain,authors,affiliations,keywords,status,created_at"
+SECTION_COLUMNS = "section_id,paper_id,section_name,content,order_index,created_at"
+
+# Max rows per document_chunks insert request (keeps PostgREST payloads bounded)
+CHUNK_INSERT_BATCH_SIZE = 500
+
+# Unique key that makes re-storing a file's chunks an idempotent upsert
+CHUNK_CONFLICT_COLUMNS = "file_id,chunk_index"
+_chunk_upsert_supported = True  # Cleared when the database lacks the unique index
+
+# Paper metadata cache for the RAG path (title/domain/authors/keywords rarely change)
+PAPER_CACHE_TTL = 60  # seconds
+PAPER_CACHE_MAX_ENTRIES = 256
+_paper_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+# Static part of the root/health-check response
+ROOT_PAYLOAD = {
+    "message": "IEEE Paper Generator API",
+    "status": "running",
+    "version": "1.0.0",
+    "features": {
+        "paper_generation": True,
+        "file_upload": True,
+        "latex_export": True,
+        "background_tasks": True
+    }
+}
+
+# Cleared when the database lacks the paper_status function (older schema.sql)
+_paper_status_rpc_available = True
+
+# PostgREST / Postgres error codes for a function that doesn't exist
+MISSING_FUNCTION_ERROR_CODES = ("PGRST202", "42883")
+
+# Strong references to fire-and-forget tasks; the event loop only keeps weak ones
+_background_tasks: "set[asyncio.Task]" = set()
+
+# Chunk size for copying in-memory upload spools to disk
+UPLOAD_READ_CHUNK_SIZE = 1 << 20  # 1MB
+
+# Upload location and accepted reference-file types, resolved once
+UPLOAD_DIR = Path(settings.upload_dir)
+ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in settings.allowed_extensions)
+
+# Compiled PDFs, one per paper, named "<paper_id>_<hash of LaTeX source>.pdf"
+PDF_CACHE_DIR = UPLOAD_DIR / "pdf_cache"
+
 # Initialize services with lazy loading
-_file_processor = None
 _embedding_model_ready = False
-content_generator = background_task_manager.content_generator
+file_processor = get_file_processor()  # Embedding model itself still loads lazily
+
+T = TypeVar("T")
+
+async def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking call (Supabase, embeddings, Gemini, LaTeX) in a worker thread"""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine in the background, keeping the task alive until it finishes"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def latex_available() -> bool:
+    """LaTeX availability, probing in a worker thread only when the cached result is stale"""
+    cached = latex_service.cached_latex_availability()
+    if cached is not None:
+        return cached
+    return await run_blocking(latex_service.is_latex_available)
+
+async def fetch_paper_with_sections(paper_id: str):
+    """Fetch a paper and its ordered sections in a single PostgREST query"""
+    result = await run_blocking(
+        supabase.table("papers")
+        .select("*, sections(*)")
+        .eq("paper_id", paper_id)
+        .order("order_index", foreign_table="sections")
+        .execute
+    )
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    paper = result.data[0]
+    sections = paper.pop("sections", None) or []
+    return paper, sections
+
+async def fetch_paper_status(paper_id: str) -> Tuple[Dict, int, int, int]:
+    """Get a paper with its file, processed-file and section counts
+    
+    Uses the paper_status RPC (one round-trip); databases without it fall back to
+    concurrent per-table queries. Returns (paper, total_files, processed_files, total_sections).
+    """
+    global _paper_status_rpc_available
+    if _paper_status_rpc_available:
+        try:
+            result = await run_blocking(supabase.rpc("paper_status", {"p": paper_id}).execute)
+            status = result.data
+            if not status:
+                raise HTTPException(status_code=404, detail="Paper not found")
+            return status["paper"], status["files_total"], status["files_processed"], status["sections_total"]
+        except HTTPException:
+            raise
+        except Exception as e:
+            # Status endpoints are polled: don't retry a missing function on every request,
+            # but other failures (network blips, bad ids) only fall back for this request
+            code = getattr(e, "code", None)
+            if code in MISSING_FUNCTION_ERROR_CODES or any(c in str(e) for c in MISSING_FUNCTION_ERROR_CODES):
+                _paper_status_rpc_available = False
+                print(f"⚠️  paper_status RPC unavailable ({e}), querying tables individually")
+            else:
+                print(f"⚠️  paper_status RPC failed ({e}), querying tables individually")
+    
+    paper_result, files_result, chunks_result, sections_result = await asyncio.gather(
+        run_blocking(supabase.table("papers").select("*").eq("paper_id", paper_id).execute),
+        run_blocking(supabase.table("files").select("file_id").eq("paper_id", paper_id).execute),
+        run_blocking(supabase.table("document_chunks").select("file_id").eq("paper_id", paper_id).execute),
+        run_blocking(supabase.table("sections").select("section_id").eq("paper_id", paper_id).execute)
+    )
+    if not paper_result.data:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    
+    return (
+        paper_result.data[0],
+        len(files_result.data),
+        len(set(chunk["file_id"] for chunk in chunks_result.data)),
+        len(sections_result.data)
+    )
 
-def get_file_processor():
-    """Get file processor instance with lazy loading"""
-    global _file_processor
-    if _file_processor is None:
-        print("🔄 Initializing file processor...")
-        _file_processor = FileProcessor()
-    return _file_processor
+async def get_paper_cached(paper_id: str, ttl: float = PAPER_CACHE_TTL) -> Optional[Dict]:
+    """Get the paper fields used for generation, served from a short-lived cache"""
+    paper_id = str(paper_id)
+    now = time.monotonic()
+    cached = _paper_cache.get(paper_id)
+    if cached and now - cached[0] < ttl:
+        _paper_cache.move_to_end(paper_id)
+        return cached[1]
+    
+    result = await run_blocking(supabase.table("papers").select("title,domain,authors,keywords").eq("paper_id", paper_id).execute)
+    if not result.data:
+        _paper_cache.pop(paper_id, None)
+        return None
+    
+    _paper_cache[paper_id] = (now, result.data[0])
+    _paper_cache.move_to_end(paper_id)
+    while len(_paper_cache) > PAPER_CACHE_MAX_ENTRIES:
+        _paper_cache.popitem(last=False)
+    return result.data[0]
+
+async def require_paper_cached(paper_id: str) -> Dict:
+    """get_paper_cached, raising 404 when the paper does not exist"""
+    paper = await get_paper_cached(paper_id)
+    if not paper:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    return paper
+
+def invalidate_paper_cache(paper_id: str):
+    """Drop a paper from the metadata cache after it changes"""
+    _paper_cache.pop(str(paper_id), None)
 
 app = FastAPI(title="IEEE Paper Generator API")
 
 @app.on_event("startup")
 async def startup_event():
     """Preload embedding model in background on startup"""
-    import asyncio
-    from concurrent.futures import ThreadPoolExecutor
-    
     async def preload_embedding_model():
         """Load embedding model in background using thread pool"""
         global _embedding_model_ready
         try:
             print("🚀 Starting background preload of embedding model...")
             
-            # Run the blocking model load in a thread pool to avoid blocking the event loop
-            loop = asyncio.get_event_loop()
-            executor = ThreadPoolExecutor(max_workers=1)
-            
             def load_model():
-                file_processor = get_file_processor()
+                get_content_generator()  # Create the Gemini client off the event loop
                 _ = file_processor.embedding_model
+                # Run one batched forward pass so lazy kernel/graph initialization happens now too
+                file_processor.generate_embeddings_batch(["warmup"])
+                # Warm the section-name query embeddings used by /api/generate
+                for section_name in COMPREHENSIVE_SECTIONS:
+                    embed_query(section_name)
                 return True
             
-            # Run in thread pool so it doesn't block the event loop
-            await loop.run_in_executor(executor, load_model)
+            # Run in a worker thread so it doesn't block the event loop
+            await run_blocking(load_model)
             
             _embedding_model_ready = True
             print("✅ Embedding model preloaded and ready!")
@@ -68,11 +223,35 @@ async def startup_event():
             print(f"⚠️  Warning: Could not preload embedding model: {e}")
             print("   Model will load on first use instead.")
     
+    async def probe_latex():
+        """Probe for pdflatex once so the first status/export request doesn't spawn it"""
+        try:
+            available = await latex_available()
+            print(f"📄 LaTeX {'available' if available else 'not found'}")
+        except Exception as e:
+            print(f"⚠️  Warning: Could not probe LaTeX: {e}")
+    
+    async def probe_schema():
+        """Detect optional metadata columns once so inserts don't discover them by failing"""
+        try:
+            for table in ("sections", "papers"):
+                if not await run_blocking(column_exists, table, "metadata"):
+                    print(f"⚠️  {table}.metadata column not found, saving without metadata")
+        except Exception as e:
+            print(f"⚠️  Warning: Could not probe database schema: {e}")
+    
     # Start preloading in background (non-blocking)
-    asyncio.create_task(preload_embedding_model())
+    spawn_background(preload_embedding_model())
+    spawn_background(probe_latex())
+    spawn_background(probe_schema())
     print("🌐 Backend API is ready to accept requests")
     print("📊 Embedding model loading in background...")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the file parsing worker processes"""
+    get_parse_executor().shutdown(wait=False, cancel_futures=True)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:5173"],
@@ -81,22 +260,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Ensure upload directory exists
-os.makedirs(settings.upload_dir, exist_ok=True)
+class TextGZipMiddleware(GZipMiddleware):
+    """GZip JSON/text responses; skips PDFs (already compressed) and streamed generations (sent chunk by chunk)"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith(("pdf", "/stream")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(TextGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Ensure upload and PDF cache directories exist
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(PDF_CACHE_DIR, exist_ok=True)
 
 @app.get("/")
 async def root():
     """Root endpoint with system status"""
     return {
-        "message": "IEEE Paper Generator API",
-        "status": "running",
-        "version": "1.0.0",
+        **ROOT_PAYLOAD,
         "features": {
-            "paper_generation": True,
-            "file_upload": True,
-            "latex_export": True,
-            "pdf_export": latex_service.is_latex_available(),
-            "background_tasks": True,
+            **ROOT_PAYLOAD["features"],
+            "pdf_export": await latex_available(),
             "embedding_model_ready": _embedding_model_ready
         }
     }
@@ -107,7 +292,8 @@ async def system_status():
     return {
         "api_status": "running",
         "embedding_model_ready": _embedding_model_ready,
-        "latex_available": latex_service.is_latex_available(),
+        "latex_available": await latex_available(),
+        "query_embedding_cache": embed_query.cache_info()._asdict(),
         "message": "Embedding model ready" if _embedding_model_ready else "Embedding model loading..."
     }
 
@@ -115,9 +301,9 @@ async def system_status():
 async def list_papers():
     """List all papers"""
     try:
-        result = supabase.table("papers").select("*").order("created_at", desc=True).execute()
+        result = await run_blocking(supabase.table("papers").select(PAPER_COLUMNS).order("created_at", desc=True).execute)
         
-        return [PaperResponse(**paper) for paper in result.data]
+        return result.data  # Validated once against response_model by FastAPI
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -125,17 +311,18 @@ async def list_papers():
 async def create_paper(paper: PaperCreate):
     """Create a new paper"""
     try:
-        result = supabase.table("papers").insert({
+        result = await run_blocking(supabase.table("papers").insert({
             "title": paper.title,
             "domain": paper.domain,
             "authors": paper.authors,
             "affiliations": paper.affiliations,
             "keywords": paper.keywords,
             "status": "draft"
-        }).execute()
+        }).execute)
         
         if result.data:
-            return PaperResponse(**result.data[0])
+            invalidate_paper_cache(result.data[0]["paper_id"])
+            return result.data[0]
         else:
             raise HTTPException(status_code=400, detail="Failed to create paper")
     except Exception as e:
@@ -145,10 +332,10 @@ async def create_paper(paper: PaperCreate):
 async def get_paper(paper_id: str):
     """Get paper by ID"""
     try:
-        result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
+        result = await run_blocking(supabase.table("papers").select(PAPER_COLUMNS).eq("paper_id", paper_id).execute)
         
         if result.data:
-            return PaperResponse(**result.data[0])
+            return result.data[0]
         else:
             raise HTTPException(status_code=404, detail="Paper not found")
     except Exception as e:
@@ -158,115 +345,220 @@ async def get_paper(paper_id: str):
 async def get_files(paper_id: str):
     """Get all files for a paper"""
     try:
-        result = supabase.table("files").select("*").eq("paper_id", paper_id).execute()
-        
-        return [FileUploadResponse(
-            file_id=file["file_id"],
-            filename=file["filename"],
-            storage_url=file["storage_url"],
-            file_size=file["file_size"]
-        ) for file in result.data]
+        result = await run_blocking(supabase.table("files").select("file_id,filename,storage_url,file_size").eq("paper_id", paper_id).execute)
+        
+        return result.data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _spooled_size(src) -> int:
+    """Size of an upload's spooled buffer"""
+    src.seek(0, os.SEEK_END)
+    size = src.tell()
+    src.seek(0)
+    return size
+
+def _persist_spooled_file(src, file_path: Path, size: int):
+    """Copy an upload's spooled buffer to file_path
+    
+    Uploads that have spilled to disk are copied kernel-side with sendfile; in-memory
+    spools (and platforms without file-to-file sendfile) use a chunked userspace copy.
+    """
+    with open(file_path, "wb") as dst:
+        if getattr(src, "_rolled", True) and hasattr(os, "sendfile"):
+            try:
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                if offset == size:
+                    return
+            except (OSError, ValueError, AttributeError):
+                pass
+            dst.seek(0)
+            dst.truncate()
+        
+        src.seek(0)
+        shutil.copyfileobj(src, dst, UPLOAD_READ_CHUNK_SIZE)
+
+async def _save_uploaded_file(paper_id: str, file: UploadFile, file_ext: str, file_size: int) -> FileUploadResponse:
+    """Save one uploaded file to disk and record it in the database (removing the file if that fails)"""
+    file_id = str(uuid.uuid4())
+    filename = f"{file_id}_{file.filename}"
+    file_path = UPLOAD_DIR / filename
+    
+    try:
+        await run_blocking(_persist_spooled_file, file.file, file_path, file_size)
+        
+        # Store file info in database first (quick response)
+        await run_blocking(supabase.table("files").insert({
+            "file_id": file_id,
+            "paper_id": paper_id,
+            "filename": file.filename,
+            "storage_url": str(file_path),
+            "file_size": file_size,
+            "file_type": file_ext
+        }).execute)
+    except Exception:
+        file_path.unlink(missing_ok=True)
+        raise
+    
+    return FileUploadResponse(
+        file_id=file_id,
+        filename=file.filename,
+        storage_url=str(file_path),
+        file_size=file_size
+    )
+
+async def _discard_uploaded_files(uploaded_files: List[FileUploadResponse]):
+    """Remove saved uploads (database rows and files on disk) after a failed batch"""
+    if not uploaded_files:
+        return
+    try:
+        await run_blocking(
+            supabase.table("files").delete().in_("file_id", [str(f.file_id) for f in uploaded_files]).execute
+        )
+    except Exception as e:
+        print(f"⚠️  Could not remove file rows after failed upload: {e}")
+    for uploaded in uploaded_files:
+        Path(uploaded.storage_url).unlink(missing_ok=True)
+
 @app.post("/api/papers/{paper_id}/upload", response_model=List[FileUploadResponse])
 async def upload_files(paper_id: str, files: List[UploadFile] = File(...)):
     """Upload reference files for a paper"""
     try:
-        uploaded_files = []
-        
+        # Validate all file types and sizes before saving anything
+        file_exts = []
+        file_sizes = []
         for file in files:
-            # Validate file type
             file_ext = Path(file.filename).suffix.lower()
-            if file_ext not in settings.allowed_extensions:
+            if file_ext not in ALLOWED_EXTENSIONS:
                 raise HTTPException(
                     status_code=400, 
                     detail=f"File type {file_ext} not allowed"
                 )
-            
-            # Save file
-            file_id = str(uuid.uuid4())
-            filename = f"{file_id}_{file.filename}"
-            file_path = Path(settings.upload_dir) / filename
-            
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                if len(content) > settings.max_file_size:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="File too large"
-                    )
-                buffer.write(content)
-            
-            # Store file info in database first (quick response)
-            file_result = supabase.table("files").insert({
-                "file_id": file_id,
-                "paper_id": paper_id,
-                "filename": file.filename,
-                "storage_url": str(file_path),
-                "file_size": len(content),
-                "file_type": file_ext
-            }).execute()
-            
-            uploaded_files.append(FileUploadResponse(
-                file_id=file_id,
-                filename=file.filename,
-                storage_url=str(file_path),
-                file_size=len(content)
-            ))
+            file_size = await run_blocking(_spooled_size, file.file)
+            if file_size > settings.max_file_size:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File {file.filename} too large"
+                )
+            file_exts.append(file_ext)
+            file_sizes.append(file_size)
+        
+        # Save files concurrently
+        results = await asyncio.gather(*[
+            _save_uploaded_file(paper_id, file, file_ext, file_size)
+            for file, file_ext, file_size in zip(files, file_exts, file_sizes)
+        ], return_exceptions=True)
+        uploaded_files = [result for result in results if isinstance(result, FileUploadResponse)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        
+        # All or nothing: files that did save would otherwise never be processed
+        if errors:
+            await _discard_uploaded_files(uploaded_files)
+            raise errors[0]
         
         # Process files asynchronously in background
-        import asyncio
-        asyncio.create_task(process_files_background(paper_id, uploaded_files))
+        spawn_background(process_files_background(paper_id, uploaded_files))
         
         return uploaded_files
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def process_files_background(paper_id: str, uploaded_files: List[FileUploadResponse]):
-    """Process files in background to avoid timeout"""
+async def store_chunk_rows(rows: List[Dict]):
+    """Write document_chunks rows, upserting on (file_id, chunk_index) so retries are idempotent"""
+    global _chunk_upsert_supported
+    if _chunk_upsert_supported:
+        try:
+            await run_blocking(
+                supabase.table("document_chunks").upsert(rows, on_conflict=CHUNK_CONFLICT_COLUMNS).execute
+            )
+            return
+        except Exception as e:
+            # 42P10: no unique index to resolve ON CONFLICT against (older schema.sql)
+            if "42P10" not in str(e) and "ON CONFLICT" not in str(e):
+                raise
+            _chunk_upsert_supported = False
+            print("⚠️  document_chunks has no (file_id, chunk_index) unique index, using plain inserts")
+    
+    await run_blocking(supabase.table("document_chunks").insert(rows).execute)
+
+async def process_uploaded_file(paper_id: str, file_info: FileUploadResponse):
+    """Parse, embed and store the chunks of one uploaded file"""
+    # Process file and extract text
+    file_path = file_info.storage_url
+    file_ext = Path(file_info.filename).suffix.lower()
+    
+    # Parse in the process pool so CPU-bound extraction runs in parallel across files
+    text, chunks = await asyncio.get_running_loop().run_in_executor(
+        get_parse_executor(), FileProcessor.process_file, file_path, file_ext
+    )
+    
+    # Embed all chunks of the file in one batched call
     try:
-        file_processor = get_file_processor()
-        
-        for file_info in uploaded_files:
-            # Process file and extract text
-            file_path = file_info.storage_url
-            file_ext = Path(file_info.filename).suffix.lower()
-            
-            text, chunks = FileProcessor.process_file(file_path, file_ext)
-            
-            # Store chunks with embeddings
-            for i, chunk in enumerate(chunks):
+        embeddings = await run_blocking(file_processor.generate_embeddings_batch, chunks)
+    except Exception as e:
+        print(f"Error generating embeddings for file {file_info.filename}: {e}")
+        return
+    
+    # Store chunks with embeddings using bulk inserts
+    rows = [{
+        "file_id": str(file_info.file_id),
+        "paper_id": paper_id,
+        "content": chunk,
+        "embedding": FileProcessor.to_pgvector_literal(embedding),
+        "chunk_index": i,
+        "metadata": {"source": file_info.filename}
+    } for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))]
+    
+    for start in range(0, len(rows), CHUNK_INSERT_BATCH_SIZE):
+        batch = rows[start:start + CHUNK_INSERT_BATCH_SIZE]
+        try:
+            await store_chunk_rows(batch)
+        except Exception as e:
+            # Retry row by row so one bad chunk doesn't drop the whole batch
+            print(f"Bulk insert of chunks {start}-{start + len(batch) - 1} for file {file_info.filename} failed ({e}), inserting individually")
+            for row in batch:
                 try:
-                    embedding = file_processor.generate_embeddings(chunk)
-                    supabase.table("document_chunks").insert({
-                        "file_id": file_info.file_id,
-                        "paper_id": paper_id,
-                        "content": chunk,
-                        "embedding": embedding,
-                        "chunk_index": i,
-                        "metadata": {"source": file_info.filename}
-                    }).execute()
+                    await store_chunk_rows([row])
                 except Exception as e:
-                    print(f"Error processing chunk {i} for file {file_info.filename}: {e}")
-                    continue
-                    
-    except Exception as e:
-        print(f"Background processing error: {e}")
+                    print(f"Error storing chunk {row['chunk_index']} for file {file_info.filename}: {e}")
+    
+    # New chunks change retrieval results for this paper
+    invalidate_paper_chunks(paper_id)
+
+async def process_files_background(paper_id: str, uploaded_files: List[FileUploadResponse]):
+    """Process files in background to avoid timeout"""
+    # Files are independent: process them concurrently, bounded to avoid overwhelming Supabase
+    semaphore = asyncio.Semaphore(settings.file_processing_concurrency)
+    
+    async def process_one(file_info: FileUploadResponse):
+        async with semaphore:
+            try:
+                await process_uploaded_file(paper_id, file_info)
+            except Exception as e:
+                print(f"Background processing error for file {file_info.filename}: {e}")
+    
+    await asyncio.gather(*[process_one(file_info) for file_info in uploaded_files])
 
 @app.post("/api/papers/{paper_id}/sections", response_model=SectionResponse)
 async def create_section(paper_id: str, section: SectionCreate):
     """Create a new section for a paper"""
     try:
-        result = supabase.table("sections").insert({
+        result = await run_blocking(supabase.table("sections").insert({
             "paper_id": paper_id,
             "section_name": section.section_name,
             "content": section.content,
             "order_index": section.order_index
-        }).execute()
+        }).execute)
         
         if result.data:
-            return SectionResponse(**result.data[0])
+            return result.data[0]
         else:
             raise HTTPException(status_code=400, detail="Failed to create section")
     except Exception as e:
@@ -276,43 +568,62 @@ async def create_section(paper_id: str, section: SectionCreate):
 async def get_sections(paper_id: str):
     """Get all sections for a paper"""
     try:
-        result = supabase.table("sections").select("*").eq("paper_id", paper_id).order("order_index").execute()
+        result = await run_blocking(supabase.table("sections").select(SECTION_COLUMNS).eq("paper_id", paper_id).order("order_index").execute)
         
-        return [SectionResponse(**section) for section in result.data]
+        return result.data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def retrieve_section_context(paper_id, section_name: str, paper: Dict) -> str:
+    """Build the RAG context for one section from the paper's most similar chunks"""
+    # Generate query embedding from cached section and paper-topic embeddings
+    query_embedding = await run_blocking(
+        compose_query_embedding, section_name, paper['title'], paper['domain']
+    )
+    
+    # Retrieve relevant chunks using vector similarity
+    matched_chunks = await run_blocking(
+        match_documents_cached,
+        str(paper_id),
+        section_name,
+        query_embedding,
+        match_threshold=0.6,  # Lowered threshold for more context
+        match_count=10  # Increased for more comprehensive context
+    )
+    
+    # Prepare comprehensive context from retrieved chunks
+    return build_context(matched_chunks or [])
+
+async def save_generated_section(paper_id, section_name: str, content: str):
+    """Save a generated section (with metadata if column exists)"""
+    metrics = get_content_generator().estimate_content_length(content)
+    
+    section_data = {
+        "paper_id": str(paper_id),
+        "section_name": section_name,
+        "content": content,
+        "order_index": 0  # Will be updated by user
+    }
+    if await run_blocking(column_exists, "sections", "metadata"):
+        section_data["metadata"] = {
+            "word_count": metrics["words"],
+            "estimated_pages": metrics["estimated_pages"],
+            "generation_timestamp": "now()"
+        }
+    
+    return await run_blocking(supabase.table("sections").insert(section_data).execute)
+
 @app.post("/api/generate", response_model=GenerationResponse)
 async def generate_content(request: GenerationRequest):
     """Generate comprehensive content for a specific section using RAG"""
     try:
         # Get paper info
-        paper_result = supabase.table("papers").select("*").eq("paper_id", str(request.paper_id)).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        paper = paper_result.data[0]
-        
-        # Generate query embedding
-        query = f"{request.section_name} {paper['title']} {paper['domain']}"
-        file_processor = get_file_processor()
-        query_embedding = file_processor.generate_embeddings(query)
-        
-        # Retrieve relevant chunks using vector similarity
-        chunks_result = supabase.rpc("match_documents", {
-            "query_embedding": query_embedding,
-            "match_threshold": 0.6,  # Lowered threshold for more context
-            "match_count": 10,  # Increased for more comprehensive context
-            "paper_id": str(request.paper_id)
-        }).execute()
+        paper = await require_paper_cached(request.paper_id)
         
-        # Prepare comprehensive context from retrieved chunks
-        context = ""
-        if chunks_result.data:
-            context = "\n\n".join([chunk["content"] for chunk in chunks_result.data])
+        context = await retrieve_section_context(request.paper_id, request.section_name, paper)
         
         # Generate comprehensive content using enhanced generator
-        generated_content = content_generator.generate_section_content(
+        generated_content = await get_content_generator().agenerate_section_content(
             section_name=request.section_name,
             paper_title=paper['title'],
             domain=paper['domain'],
@@ -320,32 +631,7 @@ async def generate_content(request: GenerationRequest):
             paper_info=paper
         )
         
-        # Estimate content metrics
-        metrics = content_generator.estimate_content_length(generated_content)
-        
-        # Save generated section (with metadata if column exists)
-        section_data = {
-            "paper_id": str(request.paper_id),
-            "section_name": request.section_name,
-            "content": generated_content,
-            "order_index": 0,  # Will be updated by user
-            "metadata": {
-                "word_count": metrics["words"],
-                "estimated_pages": metrics["estimated_pages"],
-                "generation_timestamp": "now()"
-            }
-        }
-        
-        try:
-            section_result = supabase.table("sections").insert(section_data).execute()
-        except Exception as db_error:
-            # If metadata column doesn't exist, try without it
-            if "metadata" in str(db_error):
-                print("⚠️  Metadata column not found, saving without metadata")
-                section_data.pop("metadata", None)
-                section_result = supabase.table("sections").insert(section_data).execute()
-            else:
-                raise db_error
+        section_result = await save_generated_section(request.paper_id, request.section_name, generated_content)
         
         if section_result.data:
             return GenerationResponse(
@@ -360,22 +646,43 @@ async def generate_content(request: GenerationRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/generate/stream")
+async def generate_content_stream(request: GenerationRequest):
+    """Stream a section's text as it is generated, then save the section
+    
+    Chunks are the raw model output; the saved section is post-processed, so clients
+    should reload the paper's sections once the stream ends.
+    """
+    paper = await require_paper_cached(request.paper_id)
+    context = await retrieve_section_context(request.paper_id, request.section_name, paper)
+    generator = get_content_generator()
+    
+    async def stream_section():
+        parts = []
+        async for text in generator.astream_section_content(
+            section_name=request.section_name,
+            paper_title=paper['title'],
+            domain=paper['domain'],
+            context=context,
+            paper_info=paper
+        ):
+            parts.append(text)
+            yield text
+        
+        content = generator.post_process_content("".join(parts), request.section_name)
+        await save_generated_section(request.paper_id, request.section_name, content)
+    
+    return StreamingResponse(stream_section(), media_type="text/plain; charset=utf-8")
+
 @app.get("/api/papers/{paper_id}/export")
 async def export_paper(paper_id: str):
     """Export complete paper as formatted text"""
     try:
-        # Get paper info
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        paper = paper_result.data[0]
-        
-        # Get all sections
-        sections_result = supabase.table("sections").select("*").eq("paper_id", paper_id).order("order_index").execute()
+        # Get paper info and all sections in one round-trip
+        paper, sections = await fetch_paper_with_sections(paper_id)
         
         # Format paper
-        formatted_paper = f"""
+        header = f"""
 {paper['title']}
 
 Authors: {', '.join(paper['authors'])}
@@ -384,12 +691,13 @@ Keywords: {', '.join(paper['keywords'])}
 
 """
         
-        for section in sections_result.data:
-            formatted_paper += f"\n{section['section_name']}\n"
-            formatted_paper += "=" * len(section['section_name']) + "\n\n"
-            formatted_paper += section['content'] + "\n\n"
+        parts = [header]
+        parts.extend(
+            f"\n{section['section_name']}\n{'=' * len(section['section_name'])}\n\n{section['content']}\n\n"
+            for section in sections
+        )
         
-        return {"paper": formatted_paper}
+        return {"paper": "".join(parts)}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -398,18 +706,11 @@ Keywords: {', '.join(paper['keywords'])}
 async def export_paper_latex(paper_id: str):
     """Export paper as IEEE-formatted LaTeX"""
     try:
-        # Get paper info
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        paper = paper_result.data[0]
-        
-        # Get all sections
-        sections_result = supabase.table("sections").select("*").eq("paper_id", paper_id).order("order_index").execute()
+        # Get paper info and all sections in one round-trip
+        paper, sections = await fetch_paper_with_sections(paper_id)
         
         # Generate LaTeX
-        latex_content = latex_service.generate_ieee_paper_latex(paper, sections_result.data)
+        latex_content = latex_service.generate_ieee_paper_latex(paper, sections)
         
         return {
             "latex": latex_content,
@@ -419,63 +720,66 @@ async def export_paper_latex(paper_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _store_compiled_pdf(tex_file: str, pdf_file: str, cached_pdf: Path, paper_id: str):
+    """Move a freshly compiled PDF into the cache, replacing the paper's older PDFs, and remove its temp files"""
+    partial = cached_pdf.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    shutil.move(pdf_file, partial)
+    os.replace(partial, cached_pdf)  # Atomic, so concurrent exports never see a partial PDF
+    
+    # Only the latest version of a paper is worth keeping; earlier edits are never requested again
+    for stale_pdf in PDF_CACHE_DIR.glob(f"{paper_id}_*.pdf"):
+        if stale_pdf != cached_pdf:
+            stale_pdf.unlink(missing_ok=True)
+    
+    # Clean up temp files
+    try:
+        os.unlink(tex_file)
+        temp_dir = os.path.dirname(tex_file)
+        if temp_dir and os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    except:
+        pass  # Ignore cleanup errors
+
 @app.get("/api/papers/{paper_id}/export/pdf")
-async def export_paper_pdf(paper_id: str):
+async def export_paper_pdf(paper_id: str, request: Request):
     """Export paper as IEEE-formatted PDF using LaTeX/MiKTeX"""
     try:
-        # Check if LaTeX is available
-        if not latex_service.is_latex_available():
-            raise HTTPException(
-                status_code=503, 
-                detail="LaTeX not available. Please install MiKTeX from https://miktex.org/"
-            )
-        
-        # Get paper info
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
+        # Get paper info and all sections in one round-trip
+        paper, sections = await fetch_paper_with_sections(paper_id)
         
-        paper = paper_result.data[0]
-        
-        # Get all sections
-        sections_result = supabase.table("sections").select("*").eq("paper_id", paper_id).order("order_index").execute()
-        
-        if not sections_result.data:
+        if not sections:
             raise HTTPException(status_code=400, detail="No sections found. Please generate some content first.")
         
         # Generate LaTeX
-        latex_content = latex_service.generate_ieee_paper_latex(paper, sections_result.data)
-        
-        # Compile to PDF
-        tex_file, pdf_file = latex_service.compile_to_pdf(latex_content)
-        
-        # Read PDF content into memory
-        with open(pdf_file, 'rb') as f:
-            pdf_content = f.read()
+        latex_content = latex_service.generate_ieee_paper_latex(paper, sections)
+        
+        # Identical LaTeX compiles to an identical PDF, so its hash doubles as the ETag
+        digest = hashlib.blake2b(latex_content.encode("utf-8"), digest_size=16).hexdigest()
+        etag = f'"{digest}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        cached_pdf = PDF_CACHE_DIR / f"{paper['paper_id']}_{digest}.pdf"
+        if not cached_pdf.exists():
+            # Check if LaTeX is available
+            if not await latex_available():
+                raise HTTPException(
+                    status_code=503, 
+                    detail="LaTeX not available. Please install MiKTeX from https://miktex.org/"
+                )
+            
+            # Compile to PDF
+            tex_file, pdf_file = await run_blocking(latex_service.compile_to_pdf, latex_content)
+            await run_blocking(_store_compiled_pdf, tex_file, pdf_file, cached_pdf, paper['paper_id'])
         
-        # Clean up temp files
-        try:
-            os.unlink(tex_file)
-            os.unlink(pdf_file)
-            # Also clean up the temp directory
-            temp_dir = os.path.dirname(pdf_file)
-            if temp_dir and os.path.exists(temp_dir):
-                import shutil
-                shutil.rmtree(temp_dir, ignore_errors=True)
-        except:
-            pass  # Ignore cleanup errors
-        
-        # Return PDF content as response
+        # Stream the cached PDF
         filename = f"{paper['title'].replace(' ', '_').replace('/', '_')}.pdf"
         
-        from fastapi.responses import Response
-        return Response(
-            content=pdf_content,
+        return FileResponse(
+            cached_pdf,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Length": str(len(pdf_content))
-            }
+            filename=filename,
+            headers={"ETag": etag}
         )
         
     except Exception as e:
@@ -487,7 +791,7 @@ async def resume_paper_generation(paper_id: str):
     """Resume paper generation from where it left off"""
     try:
         # Get paper info
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
+        paper_result = await run_blocking(supabase.table("papers").select("paper_id,status").eq("paper_id", paper_id).execute)
         if not paper_result.data:
             raise HTTPException(status_code=404, detail="Paper not found")
         
@@ -498,11 +802,11 @@ async def resume_paper_generation(paper_id: str):
             return {"message": "Paper generation already completed", "paper_id": paper_id}
         
         # Test API connection first
-        if not content_generator.test_api_connection():
+        if not await run_blocking(get_content_generator().test_api_connection):
             raise HTTPException(status_code=503, detail="Gemini API quota exceeded or unavailable. Please wait and try again later.")
         
         # Start background generation (it will resume from where it left off)
-        task_id = background_task_manager.start_paper_generation(paper_id)
+        task_id = get_background_task_manager().start_paper_generation(paper_id)
         
         return {
             "message": "Paper generation resumed in background",
@@ -519,16 +823,14 @@ async def generate_complete_paper(paper_id: str):
     """Start generating a complete comprehensive IEEE paper in the background"""
     try:
         # Test API connection first
-        if not content_generator.test_api_connection():
+        if not await run_blocking(get_content_generator().test_api_connection):
             raise HTTPException(status_code=503, detail="Gemini API quota exceeded or unavailable. Please wait and try again later.")
         
-        # Get paper info
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
+        # Make sure the paper exists
+        await require_paper_cached(paper_id)
         
         # Start background generation
-        task_id = background_task_manager.start_paper_generation(paper_id)
+        task_id = get_background_task_manager().start_paper_generation(paper_id)
         
         return {
             "message": "Paper generation started in background",
@@ -545,20 +847,12 @@ async def generate_complete_paper(paper_id: str):
 async def get_generation_status(paper_id: str):
     """Get detailed generation status for a paper"""
     try:
-        # Get paper status
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        paper = paper_result.data[0]
-        
-        # Get sections count
-        sections_result = supabase.table("sections").select("section_id").eq("paper_id", paper_id).execute()
-        sections_count = len(sections_result.data)
+        # Get paper status and sections count
+        paper, _, _, sections_count = await fetch_paper_status(paper_id)
         
         # Check if there's an active background task
         task_id = f"generate_paper_{paper_id}"
-        task_status = background_task_manager.get_task_status(task_id)
+        task_status = await get_background_task_manager().get_task_status(task_id)
         
         return {
             "paper_id": paper_id,
@@ -579,21 +873,22 @@ async def get_generation_status(paper_id: str):
         }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=int(os.getenv("WEB_CONCURRENCY", "1")))
 
 @app.get("/api/latex/status")
 async def latex_status():
     """Check LaTeX availability"""
+    available = await latex_available()
     return {
-        "latex_available": latex_service.is_latex_available(),
-        "message": "LaTeX is available" if latex_service.is_latex_available() 
+        "latex_available": available,
+        "message": "LaTeX is available" if available 
                   else "LaTeX not found. Install TeX Live or MiKTeX for PDF export."
     }
 
 @app.get("/api/latex/test")
 async def test_latex():
     """Test LaTeX compilation with a simple document"""
-    if not latex_service.is_latex_available():
+    if not await latex_available():
         raise HTTPException(
             status_code=503, 
             detail="LaTeX not available. Please install TeX Live or MiKTeX."
@@ -623,7 +918,7 @@ LaTeX compilation is working successfully.
         
         # Compile test document
         with tempfile.TemporaryDirectory() as temp_dir:
-            tex_file, pdf_file = latex_service.compile_to_pdf(test_latex, temp_dir)
+            tex_file, pdf_file = await run_blocking(latex_service.compile_to_pdf, test_latex, temp_dir)
             
             return {
                 "status": "success",
@@ -641,7 +936,7 @@ LaTeX compilation is working successfully.
 @app.get("/api/latex/test-pdf")
 async def test_pdf_download():
     """Test PDF download with a simple document"""
-    if not latex_service.is_latex_available():
+    if not await latex_available():
         raise HTTPException(
             status_code=503, 
             detail="LaTeX not available. Please install TeX Live or MiKTeX."
@@ -666,30 +961,14 @@ If you can download this PDF, the system is working correctly.
 """
         
         # Compile test document
-        tex_file, pdf_file = latex_service.compile_to_pdf(simple_latex)
-        
-        # Read PDF content into memory
-        with open(pdf_file, 'rb') as f:
-            pdf_content = f.read()
+        tex_file, pdf_file = await run_blocking(latex_service.compile_to_pdf, simple_latex)
         
-        # Clean up temp files
-        try:
-            os.unlink(tex_file)
-            os.unlink(pdf_file)
-            temp_dir = os.path.dirname(pdf_file)
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
-        except:
-            pass
-        
-        # Return PDF content as response
-        return Response(
-            content=pdf_content,
+        # Stream the PDF from disk, then remove the temp directory in a worker thread
+        return FileResponse(
+            pdf_file,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": "attachment; filename=test.pdf",
-                "Content-Length": str(len(pdf_content))
-            }
+            filename="test.pdf",
+            background=BackgroundTask(shutil.rmtree, os.path.dirname(pdf_file), ignore_errors=True)
         )
     
     except Exception as e:
@@ -703,22 +982,20 @@ async def get_paper_metrics(paper_id: str):
     """Get comprehensive metrics for a paper"""
     try:
         # Get all sections for the paper
-        sections_result = supabase.table("sections").select("*").eq("paper_id", paper_id).execute()
+        sections_result = await run_blocking(supabase.table("sections").select("section_name,content").eq("paper_id", paper_id).execute)
         
-        total_words = 0
-        total_sections = len(sections_result.data)
-        section_metrics = []
+        sections = sections_result.data
+        total_sections = len(sections)
         
-        for section in sections_result.data:
-            content = section.get('content', '')
-            words = len(content.split())
-            total_words += words
-            
-            section_metrics.append({
-                "section_name": section.get('section_name', ''),
-                "word_count": words,
-                "estimated_pages": round(words / 250, 1)
-            })
+        # str.split() is the fastest exact whitespace word count in CPython
+        word_counts = [len((section.get('content') or '').split()) for section in sections]
+        total_words = sum(word_counts)
+        
+        section_metrics = [{
+            "section_name": section.get('section_name', ''),
+            "word_count": words,
+            "estimated_pages": round(words / 250, 1)
+        } for section, words in zip(sections, word_counts)]
         
         total_pages = round(total_words / 250, 1)
         
@@ -743,25 +1020,8 @@ async def get_paper_metrics(paper_id: str):
 async def get_processing_status(paper_id: str):
     """Check file processing and paper generation status"""
     try:
-        # Get paper info with current status
-        paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
-        if not paper_result.data:
-            raise HTTPException(status_code=404, detail="Paper not found")
-        
-        paper = paper_result.data[0]
-        
-        # Get files for this paper
-        files_result = supabase.table("files").select("*").eq("paper_id", paper_id).execute()
-        
-        # Get chunks for this paper
-        chunks_result = supabase.table("document_chunks").select("file_id").eq("paper_id", paper_id).execute()
-        
-        # Get sections for this paper
-        sections_result = supabase.table("sections").select("*").eq("paper_id", paper_id).execute()
-        
-        total_files = len(files_result.data)
-        processed_files = len(set(chunk["file_id"] for chunk in chunks_result.data))
-        total_sections = len(sections_result.data)
+        # Get paper info with current status and file/chunk/section counts
+        paper, total_files, processed_files, total_sections = await fetch_paper_status(paper_id)
         
         # File processing status
         file_processing = {
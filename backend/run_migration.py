@@ -4,33 +4,18 @@ Simple migration script to add metadata column to sections table
 """
 
 import os
-from supabase import create_client, Client
-from config import get_settings
+from supabase import Client
+from database import get_supabase
 
 def run_migration():
     """Add metadata column to sections table if it doesn't exist"""
-    settings = get_settings()
-    
-    # Initialize Supabase client
-    supabase: Client = create_client(settings.supabase_url, settings.supabase_key)
+    # Use the shared pooled Supabase client
+    supabase: Client = get_supabase()
     
     try:
-        # Try to add the metadata column
-        result = supabase.rpc('exec', {
-            'sql': '''
-            DO $$ 
-            BEGIN
-                IF NOT EXISTS (
-                    SELECT 1 FROM information_schema.columns 
-                    WHERE table_name = 'sections' AND column_name = 'metadata'
-                ) THEN
-                    ALTER TABLE sections ADD COLUMN metadata JSONB;
-                    RAISE NOTICE 'Added metadata column to sections table';
-                ELSE
-                    RAISE NOTICE 'Metadata column already exists in sections table';
-                END IF;
-            END $$;
-            '''
+        # Single idempotent statement; safe to re-run, so no existence check is needed
+        supabase.rpc('exec', {
+            'sql': 'ALTER TABLE sections ADD COLUMN IF NOT EXISTS metadata JSONB;'
         }).execute()
         
         print("✅ Migration completed successfully")
@@ -50,16 +50,29 @@ CREATE TABLE IF NOT EXISTS document_chunks (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Background job status (complete-paper generation), shared by all backend workers
+CREATE TABLE IF NOT EXISTS background_jobs (
+    task_id TEXT PRIMARY KEY,
+    paper_id UUID REFERENCES papers(paper_id) ON DELETE CASCADE,
+    status TEXT NOT NULL,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_sections_paper_id ON sections(paper_id);
 CREATE INDEX IF NOT EXISTS idx_files_paper_id ON files(paper_id);
 CREATE INDEX IF NOT EXISTS idx_chunks_paper_id ON document_chunks(paper_id);
-CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON document_chunks(file_id);
+-- Unique per file so chunk writes can be idempotent upserts (also serves file_id lookups)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_file_chunk ON document_chunks(file_id, chunk_index);
 
--- Create vector similarity search index
+-- Create vector similarity search index (HNSW: no training step, better recall/latency than ivfflat)
+-- Indexed at half precision: half the index size and memory bandwidth, full-precision vectors kept in the table
 CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON document_chunks 
-USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+USING hnsw ((embedding::halfvec(384)) halfvec_cosine_ops)
+WITH (m = 16, ef_construction = 64);
 
 -- Function to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -77,6 +90,9 @@ CREATE TRIGGER update_papers_updated_at BEFORE UPDATE ON papers
 CREATE TRIGGER update_sections_updated_at BEFORE UPDATE ON sections
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+CREATE TRIGGER update_background_jobs_updated_at BEFORE UPDATE ON background_jobs
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
 -- Function for vector similarity search
 CREATE OR REPLACE FUNCTION match_documents(
     query_embedding vector(384),
@@ -93,6 +109,15 @@ RETURNS TABLE (
 LANGUAGE plpgsql
 AS $$
 BEGIN
+    -- The paper_id filter is applied to HNSW candidates after the index scan, so widen the
+    -- candidate list and (pgvector 0.8+) keep scanning until match_count rows pass the filter
+    PERFORM set_config('hnsw.ef_search', least(greatest(match_count * 4, 40), 1000)::text, true);
+    BEGIN
+        PERFORM set_config('hnsw.iterative_scan', 'strict_order', true);
+    EXCEPTION WHEN OTHERS THEN
+        NULL;  -- pgvector < 0.8: no iterative scans, the wider ef_search still applies
+    END;
+
     RETURN QUERY
     SELECT
         document_chunks.chunk_id,
@@ -101,8 +126,36 @@ BEGIN
         document_chunks.metadata
     FROM document_chunks
     WHERE document_chunks.paper_id = match_documents.paper_id
-        AND 1 - (document_chunks.embedding <=> query_embedding) > match_threshold
-    ORDER BY document_chunks.embedding <=> query_embedding
+        AND document_chunks.embedding <=> query_embedding < 1 - match_threshold
+    ORDER BY document_chunks.embedding::halfvec(384) <=> query_embedding::halfvec(384)
     LIMIT match_count;
 END;
-$$;
\ No newline at end of file
+$$;
+
+-- Cheap schema probe used by the backend to detect optional columns
+CREATE OR REPLACE FUNCTION column_exists(tbl text, col text)
+RETURNS boolean
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = tbl AND column_name = col
+    );
+$$;
+
+-- Paper row plus file/chunk/section counts in one round-trip (status polling endpoints)
+CREATE OR REPLACE FUNCTION paper_status(p uuid)
+RETURNS json
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT json_build_object(
+        'paper', row_to_json(papers),
+        'files_total', (SELECT count(*) FROM files WHERE files.paper_id = papers.paper_id),
+        'files_processed', (SELECT count(DISTINCT file_id) FROM document_chunks WHERE document_chunks.paper_id = papers.paper_id),
+        'sections_total', (SELECT count(*) FROM sections WHERE sections.paper_id = papers.paper_id)
+    )
+    FROM papers
+    WHERE papers.paper_id = p;
+$$;
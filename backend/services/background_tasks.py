@@ -3,111 +3,105 @@ Background task service for long-running operations
 """
 
 import asyncio
-import threading
-from typing import Dict, Any, Optional
-from services.content_generator import ComprehensiveContentGenerator
-from services.file_processor import FileProcessor
-from supabase import create_client
+import time
+from functools import lru_cache
+import numpy as np
+from typing import Dict, Any, List, Optional
+from services.content_generator import ComprehensiveContentGenerator, get_content_generator
+from services.file_processor import FileProcessor, get_file_processor, embed_query, compose_query_embedding
+from services.retrieval import match_documents_cached, match_documents_local, build_context
+from database import supabase, column_exists, retry_db
 from config import get_settings
 
 settings = get_settings()
-supabase = create_client(settings.supabase_url, settings.supabase_key)
+
+# Sections generated for a complete paper, in order
+COMPREHENSIVE_SECTIONS = (
+    "Abstract", "Introduction", "Literature Review", "Methodology",
+    "System Design", "Implementation", "Experimental Setup",
+    "Results", "Discussion", "Conclusion", "Future Work"
+)
+SECTION_ORDER = {section_name: i for i, section_name in enumerate(COMPREHENSIVE_SECTIONS)}
+
+# Minimum seconds between mid-generation progress writes for one paper; batches finishing
+# closer together are coalesced and the next write (or the final status) carries their progress
+PROGRESS_WRITE_INTERVAL = 2.0
 
 class BackgroundTaskManager:
     def __init__(self):
         self.tasks = {}
-        # Use lazy loading for heavy services
-        self._content_generator: Optional[ComprehensiveContentGenerator] = None
-        self._file_processor: Optional[FileProcessor] = None
+        # Shared by every paper being generated, so concurrent papers together stay
+        # within the provider's rate limit rather than each getting its own allowance
+        self._generation_slots = asyncio.Semaphore(settings.section_generation_concurrency)
+        # Papers generated at once; further requests wait (status "queued") for a free slot
+        self._paper_slots = asyncio.Semaphore(settings.max_concurrent_papers)
     
     @property
     def content_generator(self) -> ComprehensiveContentGenerator:
-        """Lazy load content generator only when needed"""
-        if self._content_generator is None:
-            print("🔄 Initializing content generator...")
-            self._content_generator = ComprehensiveContentGenerator()
-        return self._content_generator
+        """Shared content generator (same Gemini client as the API endpoints)"""
+        return get_content_generator()
     
     @property
     def file_processor(self) -> FileProcessor:
-        """Lazy load file processor only when needed"""
-        if self._file_processor is None:
-            print("🔄 Initializing file processor...")
-            self._file_processor = FileProcessor()
-        return self._file_processor
+        """Shared file processor (same embedding model as the API endpoints)"""
+        return get_file_processor()
     
     def start_paper_generation(self, paper_id: str) -> str:
-        """Start background paper generation task"""
+        """Start background paper generation task (must be called from the running event loop)"""
         task_id = f"generate_paper_{paper_id}"
         
-        # Start the task in a separate thread
-        thread = threading.Thread(
-            target=self._generate_complete_paper_background,
-            args=(paper_id, task_id)
+        # Don't start a second run while one is still in progress for this paper
+        existing = self.tasks.get(task_id)
+        if existing and not existing["task"].done():
+            return task_id
+        
+        # Schedule the generation coroutine; blocking calls inside it run in worker threads
+        task = asyncio.get_running_loop().create_task(
+            self._generate_complete_paper_background(paper_id, task_id)
         )
-        thread.daemon = True
-        thread.start()
         
         self.tasks[task_id] = {
-            "status": "started",
+            "status": "queued",
             "paper_id": paper_id,
-            "thread": thread
+            "task": task
         }
         
         return task_id
     
-    def _generate_complete_paper_background(self, paper_id: str, task_id: str):
-        """Background task for generating complete paper"""
+    async def _generate_complete_paper_background(self, paper_id: str, task_id: str):
+        """Background task for generating complete paper, once a paper slot is free"""
+        # Visible to other workers while waiting for a slot; the run itself records "running"
+        await self._record_job(task_id, paper_id, "queued")
+        async with self._paper_slots:
+            await self._generate_complete_paper(paper_id, task_id)
+    
+    async def _generate_complete_paper(self, paper_id: str, task_id: str):
+        """Generate all missing sections of a paper"""
         try:
             # Update task status
             if task_id in self.tasks:
                 self.tasks[task_id]["status"] = "running"
+            await self._record_job(task_id, paper_id, "running")
             
             print(f"Background: Starting paper generation for {paper_id}")
             
-            # Get paper info
-            paper_result = supabase.table("papers").select("*").eq("paper_id", paper_id).execute()
+            # Get paper info and the names of already generated sections in one round-trip
+            paper_result = await asyncio.to_thread(
+                supabase.table("papers").select("*, sections(section_name)").eq("paper_id", paper_id).execute
+            )
             if not paper_result.data:
                 raise Exception("Paper not found")
             
             paper = paper_result.data[0]
-            
-            # Update paper status (without metadata if column doesn't exist)
-            try:
-                supabase.table("papers").update({"status": "generating"}).eq("paper_id", paper_id).execute()
-            except Exception as e:
-                print(f"Warning: Could not update paper status: {str(e)}")
+            existing_sections = set(section["section_name"] for section in paper.pop("sections", None) or [])
             
             # Define sections
-            comprehensive_sections = [
-                "Abstract", "Introduction", "Literature Review", "Methodology",
-                "System Design", "Implementation", "Experimental Setup",
-                "Results", "Discussion", "Conclusion", "Future Work"
-            ]
-            
-            # Generate context
-            query = f"comprehensive research paper {paper['title']} {paper['domain']}"
-            query_embedding = self.file_processor.generate_embeddings(query)
-            
-            chunks_result = supabase.rpc("match_documents", {
-                "query_embedding": query_embedding,
-                "match_threshold": 0.5,
-                "match_count": 20,
-                "paper_id": str(paper_id)
-            }).execute()
-            
-            context = ""
-            if chunks_result.data:
-                context = "\n\n".join([chunk["content"] for chunk in chunks_result.data])
-            
-            # Check which sections already exist
-            existing_sections_result = supabase.table("sections").select("section_name").eq("paper_id", paper_id).execute()
-            existing_sections = set(section["section_name"] for section in existing_sections_result.data)
+            total_sections = len(COMPREHENSIVE_SECTIONS)
             
             print(f"Background: Found {len(existing_sections)} existing sections: {existing_sections}")
             
             # Group sections into pairs for batch generation
-            remaining_sections = [s for s in comprehensive_sections if s not in existing_sections]
+            remaining_sections = [s for s in COMPREHENSIVE_SECTIONS if s not in existing_sections]
             section_pairs = []
             
             # Create pairs of sections
@@ -122,128 +116,87 @@ class BackgroundTaskManager:
             generated_sections = []
             total_words = 0
             
-            # Generate sections in pairs to reduce API calls
-            for batch_idx, section_batch in enumerate(section_pairs):
+            # Mark generation as started
+            await asyncio.to_thread(self._update_progress, paper_id, "generating", {
+                "current_section": " & ".join(remaining_sections),
+                "completed_sections": len(existing_sections),
+                "total_sections": total_sections,
+                "progress_percentage": round((len(existing_sections) / total_sections) * 100)
+            })
+            last_progress_write = time.monotonic()
+            
+            # Paper-wide context, only retrieved if a batch's targeted retrieval comes up empty
+            # (e.g. resumed papers whose chunks are all cached locally never need it)
+            paper_context = None
+            
+            async def get_paper_context() -> str:
+                nonlocal paper_context
+                if paper_context is None:
+                    paper_context = asyncio.ensure_future(
+                        asyncio.to_thread(self._paper_context, paper_id, paper)
+                    )
+                return await paper_context
+            
+            # Generate section batches concurrently (bounded to respect provider rate limits)
+            async def generate_batch(section_batch: List[str]):
                 try:
-                    print(f"Background: Generating batch {batch_idx + 1}/{len(section_pairs)}: {section_batch}")
-                    
-                    # Update progress
-                    current_section_name = " & ".join(section_batch)
-                    completed_count = len(existing_sections) + len(generated_sections)
-                    
-                    try:
-                        progress = {
-                            "current_section": current_section_name,
-                            "completed_sections": completed_count,
-                            "total_sections": len(comprehensive_sections),
-                            "progress_percentage": round((completed_count / len(comprehensive_sections)) * 100)
-                        }
-                        
-                        supabase.table("papers").update({
-                            "status": f"generating_batch_{batch_idx + 1}",
-                            "metadata": progress
-                        }).eq("paper_id", paper_id).execute()
-                    except Exception:
-                        supabase.table("papers").update({
-                            "status": f"generating_batch_{batch_idx + 1}"
-                        }).eq("paper_id", paper_id).execute()
-                    
-                    # Add delay between batches
-                    if batch_idx > 0:
-                        import time
-                        time.sleep(15)  # Longer delay between batches
-                    
-                    # Generate content for the batch
-                    if len(section_batch) > 1:
-                        # Multi-section generation
-                        batch_content = self.content_generator.generate_multiple_sections_content(
-                            section_names=section_batch,
-                            paper_title=paper['title'],
-                            domain=paper['domain'],
-                            context=context,
-                            paper_info=paper
-                        )
-                    else:
-                        # Single section generation
-                        section_name = section_batch[0]
-                        generated_content = self.content_generator.generate_section_content(
-                            section_name=section_name,
-                            paper_title=paper['title'],
-                            domain=paper['domain'],
-                            context=context,
-                            paper_info=paper
+                    # Retrieval is local and doesn't count against the LLM slots
+                    batch_context = await asyncio.to_thread(
+                        self._section_batch_context, paper_id, section_batch, paper
+                    )
+                    if batch_context is None:
+                        batch_context = await get_paper_context()
+                    async with self._generation_slots:
+                        return section_batch, await self._generate_section_batch(
+                            section_batch, paper, batch_context
                         )
-                        batch_content = {section_name: generated_content}
-                    
-                    # Save each section from the batch
-                    for section_name, generated_content in batch_content.items():
-                        try:
-                            # Calculate metrics
-                            metrics = self.content_generator.estimate_content_length(generated_content)
-                            total_words += metrics["words"]
-                            
-                            # Get section index for ordering
-                            section_index = comprehensive_sections.index(section_name)
-                            
-                            # Save section
-                            section_data = {
-                                "paper_id": str(paper_id),
-                                "section_name": section_name,
-                                "content": generated_content,
-                                "order_index": section_index
-                            }
-                            
-                            try:
-                                section_data["metadata"] = {
-                                    "word_count": metrics["words"],
-                                    "estimated_pages": metrics["estimated_pages"],
-                                    "generation_timestamp": "now()"
-                                }
-                                section_result = supabase.table("sections").insert(section_data).execute()
-                            except Exception as db_error:
-                                if "metadata" in str(db_error):
-                                    section_data.pop("metadata", None)
-                                    section_result = supabase.table("sections").insert(section_data).execute()
-                                else:
-                                    raise db_error
-                            
-                            if section_result.data:
-                                generated_sections.append({
-                                    "section_id": section_result.data[0]["section_id"],
-                                    "section_name": section_name,
-                                    "word_count": metrics["words"],
-                                    "estimated_pages": metrics["estimated_pages"]
-                                })
-                                print(f"Background: ✅ Generated {section_name}: {metrics['words']} words")
-                        
-                        except Exception as e:
-                            print(f"Background: ❌ Error saving {section_name}: {str(e)}")
-                            continue
-                
                 except Exception as e:
                     print(f"Background: ❌ Error generating batch {section_batch}: {str(e)}")
+                    return section_batch, None
+            
+            batches = asyncio.as_completed([generate_batch(section_batch) for section_batch in section_pairs])
+            for batch_idx, next_batch in enumerate(batches):
+                section_batch, batch_content = await next_batch
+                if batch_content is None:
                     continue
+                
+                # Save all sections from the batch in one bulk insert
+                try:
+                    saved_sections = await asyncio.to_thread(
+                        self._save_sections, paper_id, batch_content
+                    )
+                except Exception as e:
+                    print(f"Background: ❌ Error saving {list(batch_content)}: {str(e)}")
+                    continue
+                
+                for saved in saved_sections:
+                    total_words += saved["word_count"]
+                    generated_sections.append(saved)
+                    print(f"Background: ✅ Generated {saved['section_name']}: {saved['word_count']} words")
+                
+                # Update progress as batches finish (throttled; the final status always follows)
+                if time.monotonic() - last_progress_write < PROGRESS_WRITE_INTERVAL:
+                    continue
+                completed_count = len(existing_sections) + len(generated_sections)
+                await asyncio.to_thread(self._update_progress, paper_id, f"generating_batch_{batch_idx + 1}", {
+                    "current_section": " & ".join(section_batch),
+                    "completed_sections": completed_count,
+                    "total_sections": total_sections,
+                    "progress_percentage": round((completed_count / total_sections) * 100)
+                })
+                last_progress_write = time.monotonic()
             
             # Complete the task
             total_pages = total_words / 250
             final_status = {
                 "completed_sections": len(generated_sections),
-                "total_sections": len(comprehensive_sections),
+                "total_sections": total_sections,
                 "progress_percentage": 100,
                 "total_words": total_words,
                 "estimated_pages": round(total_pages, 1)
             }
             
-            try:
-                supabase.table("papers").update({
-                    "status": "completed",
-                    "metadata": final_status
-                }).eq("paper_id", paper_id).execute()
-            except Exception:
-                # If metadata column doesn't exist in papers table
-                supabase.table("papers").update({
-                    "status": "completed"
-                }).eq("paper_id", paper_id).execute()
+            await asyncio.to_thread(self._update_progress, paper_id, "completed", final_status)
             
             if task_id in self.tasks:
                 self.tasks[task_id]["status"] = "completed"
@@ -253,6 +206,12 @@ class BackgroundTaskManager:
                     "estimated_pages": round(total_pages, 1),
                     "sections": generated_sections
                 }
+            await self._record_job(task_id, paper_id, "completed", result={
+                "sections_generated": len(generated_sections),
+                "total_words": total_words,
+                "estimated_pages": round(total_pages, 1),
+                "sections": generated_sections
+            })
             
             print(f"Background: ✅ Paper generation completed for {paper_id}")
             
@@ -260,23 +219,165 @@ class BackgroundTaskManager:
             print(f"Background: ❌ Paper generation failed for {paper_id}: {str(e)}")
             
             # Update paper status to error
-            try:
-                supabase.table("papers").update({
-                    "status": "error",
-                    "metadata": {"error": str(e)}
-                }).eq("paper_id", paper_id).execute()
-            except Exception:
-                supabase.table("papers").update({
-                    "status": "error"
-                }).eq("paper_id", paper_id).execute()
+            await asyncio.to_thread(self._update_progress, paper_id, "error", {"error": str(e)})
             
             if task_id in self.tasks:
                 self.tasks[task_id]["status"] = "failed"
                 self.tasks[task_id]["error"] = str(e)
+            await self._record_job(task_id, paper_id, "failed", error=str(e))
     
-    def get_task_status(self, task_id: str) -> Dict[str, Any]:
+    def _paper_context(self, paper_id: str, paper: Dict[str, Any]) -> str:
+        """Retrieve context for the paper as a whole via the match_documents RPC"""
+        query = f"comprehensive research paper {paper['title']} {paper['domain']}"
+        matched_chunks = match_documents_cached(
+            str(paper_id), "complete_paper", embed_query(query), match_threshold=0.5, match_count=20
+        )
+        return build_context(matched_chunks or [])
+    
+    def _section_batch_context(
+        self, paper_id: str, section_batch: List[str], paper: Dict[str, Any]
+    ) -> Optional[str]:
+        """Retrieve context targeted at a batch of sections from the paper's in-memory chunk matrix
+        
+        Query embeddings come from the embed_query cache and the stored chunk embeddings are
+        reused, so nothing is re-embedded; returns None on any miss so the caller can fall
+        back to the paper-wide context.
+        """
+        title, domain = paper['title'], paper['domain']
+        try:
+            query_embedding = np.mean([
+                compose_query_embedding(section_name, title, domain)
+                for section_name in section_batch
+            ], axis=0)
+            chunks = match_documents_local(str(paper_id), query_embedding, match_threshold=0.5, match_count=20)
+        except Exception as e:
+            print(f"Background: Warning: per-batch retrieval failed ({str(e)}), using paper-wide context")
+            return None
+        
+        if not chunks:
+            return None
+        return build_context(chunks)
+    
+    async def _generate_section_batch(self, section_batch: List[str], paper: Dict[str, Any], context: str) -> Dict[str, str]:
+        """Generate content for one batch of sections with the async Gemini client"""
+        print(f"Background: Generating batch: {section_batch}")
+        
+        if len(section_batch) > 1:
+            # Multi-section generation
+            return await self.content_generator.agenerate_multiple_sections_content(
+                section_names=section_batch,
+                paper_title=paper['title'],
+                domain=paper['domain'],
+                context=context,
+                paper_info=paper
+            )
+        
+        # Single section generation
+        section_name = section_batch[0]
+        generated_content = await self.content_generator.agenerate_section_content(
+            section_name=section_name,
+            paper_title=paper['title'],
+            domain=paper['domain'],
+            context=context,
+            paper_info=paper
+        )
+        return {section_name: generated_content}
+    
+    def _save_sections(
+        self, paper_id: str, batch_content: Dict[str, str]
+    ) -> List[Dict[str, Any]]:
+        """Insert generated sections in a single request and return their summaries"""
+        if not batch_content:
+            return []
+        
+        has_metadata = column_exists("sections", "metadata")
+        rows = []
+        metrics_by_section = {}
+        for section_name, generated_content in batch_content.items():
+            # Calculate metrics
+            metrics = self.content_generator.estimate_content_length(generated_content)
+            metrics_by_section[section_name] = metrics
+            row = {
+                "paper_id": str(paper_id),
+                "section_name": section_name,
+                "content": generated_content,
+                "order_index": SECTION_ORDER[section_name]
+            }
+            if has_metadata:
+                row["metadata"] = {
+                    "word_count": metrics["words"],
+                    "estimated_pages": metrics["estimated_pages"],
+                    "generation_timestamp": "now()"
+                }
+            rows.append(row)
+        
+        result = retry_db(supabase.table("sections").insert(rows).execute)
+        
+        return [
+            {
+                "section_id": row["section_id"],
+                "section_name": row["section_name"],
+                "word_count": metrics_by_section[row["section_name"]]["words"],
+                "estimated_pages": metrics_by_section[row["section_name"]]["estimated_pages"]
+            }
+            for row in result.data or []
+        ]
+    
+    def _update_progress(self, paper_id: str, status: str, progress: Dict[str, Any]):
+        """Update paper status and progress metadata (without metadata if column doesn't exist)"""
+        try:
+            update = {"status": status}
+            if column_exists("papers", "metadata"):
+                update["metadata"] = progress
+            retry_db(supabase.table("papers").update(update).eq("paper_id", paper_id).execute, idempotent=True)
+        except Exception as e:
+            print(f"Warning: Could not update paper status: {str(e)}")
+    
+    async def _record_job(
+        self,
+        task_id: str,
+        paper_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None
+    ):
+        """Persist a task's status so other workers and restarted processes can report it"""
+        try:
+            if not await asyncio.to_thread(column_exists, "background_jobs", "task_id"):
+                return  # Database created before the background_jobs table
+            await asyncio.to_thread(
+                supabase.table("background_jobs").upsert({
+                    "task_id": task_id,
+                    "paper_id": str(paper_id),
+                    "status": status,
+                    "result": result,
+                    "error": error
+                }).execute
+            )
+        except Exception as e:
+            print(f"Warning: Could not record background job status: {str(e)}")
+    
+    async def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """Get status of a background task"""
-        return self.tasks.get(task_id, {"status": "not_found"})
+        task_info = self.tasks.get(task_id)
+        if task_info is not None:
+            # The asyncio.Task handle isn't JSON-serializable
+            return {key: value for key, value in task_info.items() if key != "task"}
+        
+        # Started by another worker, or before this process restarted
+        try:
+            if await asyncio.to_thread(column_exists, "background_jobs", "task_id"):
+                job_result = await asyncio.to_thread(
+                    supabase.table("background_jobs").select("paper_id,status,result,error").eq("task_id", task_id).execute
+                )
+                if job_result.data:
+                    return {key: value for key, value in job_result.data[0].items() if value is not None}
+        except Exception as e:
+            print(f"Warning: Could not read background job status: {str(e)}")
+        
+        return {"status": "not_found"}
 
-# Global instance
-background_task_manager = BackgroundTaskManager()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_background_task_manager() -> BackgroundTaskManager:
+    """Get the shared background task manager (created on first use)"""
+    return BackgroundTaskManager()
\ No newline at end of file
@@ -1,111 +1,337 @@
 import google.genai as genai
-from typing import Dict, List, Optional
+from google.genai import types
+from types import MappingProxyType
+from typing import AsyncIterator, Callable, Dict, List, Mapping, Optional, Tuple, TypeVar
+from functools import lru_cache
 from config import get_settings
+import asyncio
+import json
+import random
 import re
 import time
+from collections import deque
+from itertools import islice
 
 settings = get_settings()
 
+T = TypeVar("T")
+
+# Shared by the single- and multi-section prompts
+COMMON_WRITING_GUIDELINES = """- IEEE style with numbered citations ([1], [2])
+- Formal academic language with logical flow between paragraphs
+- Support claims with evidence from the context or established knowledge
+- Quality expected at top-tier IEEE venues
+"""
+
+# Static prompt scaffolding for single-section generation, filled with str.format().
+# Ordered from most to least shared (static guidelines, paper, context, section) so calls
+# for the same paper repeat the longest possible prefix for Gemini's implicit prefix cache.
+SECTION_PROMPT_TEMPLATE = """
+You are an expert researcher writing a paper for a top-tier IEEE venue.
+
+GUIDELINES:
+- Meet the target length with substantial, detailed content
+- Technical depth: algorithms and mathematical formulations where relevant
+- Original analysis, not just summary
+""" + COMMON_WRITING_GUIDELINES + """
+PAPER:
+- Title: {paper_title}
+- Domain: {domain}
+- Authors: {authors}
+- Keywords: {keywords}
+
+REFERENCE CONTEXT:
+{context}
+
+SECTION: {section_name}
+- Target Length: {length}
+- Structure: {structure}
+- Requirements: {requirements}
+
+{section_name} INSTRUCTIONS:
+"""
+
+# Target length, structure and requirements per IEEE section (read-only, shared by every prompt)
+SECTION_REQUIREMENTS: Mapping[str, Dict[str, str]] = MappingProxyType({
+    "Abstract": {
+        "length": "150-200 words",
+        "structure": "Background, Problem, Method, Results, Conclusion",
+        "requirements": "Concise summary of entire paper, no citations, standalone"
+    },
+    "Introduction": {
+        "length": "400-600 words", 
+        "structure": "Background, Problem Statement, Motivation, Contributions",
+        "requirements": "Clear problem definition, motivation, research gap, contributions"
+    },
+    "Literature Review": {
+        "length": "500-700 words",
+        "structure": "Related Work Categories, Critical Analysis, Research Gaps",
+        "requirements": "Comprehensive survey, critical analysis, identify gaps"
+    },
+    "Related Work": {
+        "length": "400-600 words",
+        "structure": "Categorized Related Work, Comparative Analysis",
+        "requirements": "Systematic categorization, comparative analysis"
+    },
+    "Methodology": {
+        "length": "600-800 words",
+        "structure": "System Architecture, Algorithm Design, Implementation Details",
+        "requirements": "Detailed technical approach, algorithms, architecture"
+    },
+    "System Design": {
+        "length": "500-700 words",
+        "structure": "Architecture Overview, Component Design, Interface Specifications",
+        "requirements": "Detailed system architecture, component interactions"
+    },
+    "Implementation": {
+        "length": "400-600 words",
+        "structure": "Technology Stack, Development Process, Key Challenges",
+        "requirements": "Technical implementation details, tools used, challenges"
+    },
+    "Experimental Setup": {
+        "length": "300-500 words",
+        "structure": "Dataset Description, Evaluation Metrics, Baseline Methods",
+        "requirements": "Comprehensive experimental design, datasets, metrics"
+    },
+    "Results": {
+        "length": "500-700 words",
+        "structure": "Quantitative Results, Performance Comparison, Discussion",
+        "requirements": "Detailed results with analysis, comparisons"
+    },
+    "Evaluation": {
+        "length": "400-600 words",
+        "structure": "Performance Analysis, Comparison Studies, Discussion",
+        "requirements": "Thorough evaluation with multiple perspectives"
+    },
+    "Discussion": {
+        "length": "400-600 words",
+        "structure": "Key Findings, Implications, Limitations",
+        "requirements": "Critical analysis of results, implications, limitations"
+    },
+    "Conclusion": {
+        "length": "200-300 words",
+        "structure": "Summary, Key Contributions, Impact",
+        "requirements": "Concise summary, clear contributions, impact statement"
+    },
+    "Future Work": {
+        "length": "200-300 words",
+        "structure": "Immediate Extensions, Long-term Directions",
+        "requirements": "Specific future research directions, potential improvements"
+    }
+})
+
+DEFAULT_SECTION_REQUIREMENTS: Mapping[str, str] = MappingProxyType({
+    "length": "300-500 words",
+    "structure": "Introduction, Main Content, Analysis, Summary",
+    "requirements": "Well-structured technical content with proper analysis"
+})
+
+SECTION_PROMPT_INSTRUCTIONS = {
+    "Abstract": """
+- Summarize problem, approach, key results and main contributions
+- Quantitative results where possible (e.g. "achieved 95% accuracy")
+- Standalone, no citations
+""",
+    "Introduction": """
+- Narrow from broad context to the specific problem and its importance
+- Why existing solutions fall short, with real-world motivation
+- The approach and a numbered list of key contributions
+- Roadmap of the paper
+""",
+    "Literature Review": """
+- Group related work by theme; critically compare 3-5 papers per theme
+- Identify limitations and gaps, and position this work against them
+- Cite throughout
+""",
+    "Methodology": """
+- Step-by-step technical approach with design rationale
+- Algorithms in pseudocode; mathematical formulations where relevant
+- System architecture and component interactions
+- Enough detail to reproduce
+""",
+    "Results": """
+- Quantitative metrics with statistical significance
+- Compare against multiple baselines, with tables and analysis
+- Explain why results occurred, including unexpected or negative ones
+""",
+    "Discussion": """
+- Implications, strengths and limitations of the results
+- Comparison with the state of the art and broader impact
+- Address likely criticisms; suggest improvements and extensions
+""",
+    "Conclusion": """
+- Restate the problem, the solution and key contributions
+- Significance, limitations and specific future work
+- End with a strong closing statement
+"""
+}
+
+DEFAULT_SECTION_PROMPT_INSTRUCTIONS = """
+- Technically sound content with detailed analysis
+- Support every claim with evidence or reasoning
+"""
+
+SECTION_PROMPT_CLOSING = """
+Write the {section_name} section now ({length}):
+"""
+
+# Per-section block of the multi-section prompt
+MULTI_SECTION_REQUIREMENTS_TEMPLATE = """
+SECTION: {section_name}
+- Target Length: {length}
+- Structure: {structure}
+- Requirements: {requirements}
+"""
+
+# Static prompt scaffolding for generating several sections in one call, filled with str.format()
+# (same most-to-least-shared ordering as SECTION_PROMPT_TEMPLATE)
+MULTI_SECTION_PROMPT_TEMPLATE = """
+You are an expert researcher writing an IEEE research paper.
+
+GUIDELINES:
+- Keep each section within its word limit
+""" + COMMON_WRITING_GUIDELINES + """
+PAPER:
+- Title: {paper_title}
+- Domain: {domain}
+- Authors: {authors}
+- Keywords: {keywords}
+
+REFERENCE CONTEXT:
+{context}...
+
+Write the sections below in one response, as a JSON object mapping each section name to its content.
+{sections}
+Write the sections now:
+"""
+
+RATE_LIMIT_KEYWORDS = ("429", "quota", "rate", "limit")
+
+def is_rate_limit_error(error_msg: str) -> bool:
+    """Whether a Gemini error message indicates a rate or quota limit (worth waiting out)"""
+    error_msg = error_msg.lower()
+    return any(keyword in error_msg for keyword in RATE_LIMIT_KEYWORDS)
+
+# Cap on exponential rate-limit backoff (seconds)
+MAX_RETRY_DELAY = 120
+
+# Server-suggested wait in quota errors, e.g. "'retryDelay': '17s'"
+RETRY_DELAY_RE = re.compile(r"""retryDelay['"]?\s*:\s*['"]?(\d+(?:\.\d+)?)s""")
+
+def backoff_delay(retry_delay: float, error_msg: str) -> float:
+    """Seconds to wait before retrying a rate-limited call
+    
+    Prefers the delay the API suggests; otherwise jitters the exponential delay so
+    concurrent calls that hit the limit together don't all retry in lockstep.
+    """
+    match = RETRY_DELAY_RE.search(error_msg)
+    if match:
+        return float(match.group(1))
+    return retry_delay * random.uniform(0.5, 1.5)
+
+class RequestRateLimiter:
+    """Async sliding-window limiter allowing at most `rate` requests per `period` seconds (0 disables it)"""
+    
+    def __init__(self, rate: int, period: float = 60.0):
+        self.rate = rate
+        self.period = period
+        self._sent = deque()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until another request fits in the window, then record it"""
+        if self.rate <= 0:
+            return
+        # Waiters queue on the lock, so requests are admitted in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.period:
+                    self._sent.popleft()
+                if len(self._sent) < self.rate:
+                    self._sent.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._sent[0]))
+
+# Post-processing patterns, compiled once
+PREAMBLE_RE = re.compile(r'^(Here is the|Here\'s the|The following is)', re.IGNORECASE)
+EXTRA_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+NEWLINES_RE = re.compile(r'\n+')
+# A numbered reference line: "[1] ...", "(1) ..." or "1. ...", optionally bulleted
+REFERENCE_LINE_RE = re.compile(r'^[ \t•]*[\[\(]?(\d+)[\]\)\.][ \t]*(.+?)[ \t\r]*$', re.MULTILINE)
+
+@lru_cache(maxsize=64)
+def section_heading_re(section_name: str) -> re.Pattern:
+    """Pattern for a leading "<section name>:" heading echoed back by the model"""
+    return re.compile(r'^' + re.escape(section_name) + r'\s*:?\s*', re.IGNORECASE)
+
+@lru_cache(maxsize=64)
+def build_section_prompt(
+    section_name: str,
+    paper_title: str,
+    domain: str,
+    context: str,
+    authors: Tuple[str, ...],
+    keywords: Tuple[str, ...]
+) -> str:
+    """Build a single-section prompt, memoized since regenerating a section repeats the same inputs"""
+    requirements = SECTION_REQUIREMENTS.get(section_name, DEFAULT_SECTION_REQUIREMENTS)
+    
+    prompt = SECTION_PROMPT_TEMPLATE.format(
+        domain=domain,
+        paper_title=paper_title,
+        authors=', '.join(authors),
+        keywords=', '.join(keywords),
+        section_name=section_name,
+        length=requirements['length'],
+        structure=requirements['structure'],
+        requirements=requirements['requirements'],
+        context=context
+    )
+    return "".join((
+        prompt,
+        SECTION_PROMPT_INSTRUCTIONS.get(section_name, DEFAULT_SECTION_PROMPT_INSTRUCTIONS),
+        SECTION_PROMPT_CLOSING.format(length=requirements['length'], section_name=section_name)
+    ))
+
 class ComprehensiveContentGenerator:
     """Generate comprehensive, high-quality IEEE paper content"""
     
     def __init__(self):
         self.client = genai.Client(api_key=settings.gemini_api_key)
         self.model = 'gemini-3-flash-preview'  # Using the latest model
+        self._api_checked_at: Optional[float] = None  # monotonic time of the last successful API test
+        # Shared by every async generation in this process (each worker process has its own)
+        self.rate_limiter = RequestRateLimiter(settings.gemini_requests_per_minute)
         print("✅ Initialized ContentGenerator with gemini-3-flash-preview")
     
     def test_api_connection(self) -> bool:
-        """Test if API is working and has quota available"""
+        """Test if API is working and has quota available
+        
+        A success is trusted for settings.api_check_ttl seconds, so starting several
+        generations doesn't spend a request (and quota) on the check each time.
+        """
+        if self._api_checked_at is not None and time.monotonic() - self._api_checked_at < settings.api_check_ttl:
+            return True
         try:
             response = self.client.models.generate_content(
                 model=self.model,
                 contents="Test message. Respond with 'API working'.",
-                config=genai.GenerateContentConfig(
+                config=types.GenerateContentConfig(
                     max_output_tokens=10,
                     temperature=0.1,
                 )
             )
             print("✅ API test successful")
+            self._api_checked_at = time.monotonic()
             return True
         except Exception as e:
             print(f"❌ API test failed: {str(e)}")
             return False
     
-    def get_section_requirements(self, section_name: str) -> Dict[str, str]:
+    def get_section_requirements(self, section_name: str) -> Mapping[str, str]:
         """Get specific requirements for each IEEE section - optimized for shorter content"""
-        requirements = {
-            "Abstract": {
-                "length": "150-200 words",
-                "structure": "Background, Problem, Method, Results, Conclusion",
-                "requirements": "Concise summary of entire paper, no citations, standalone"
-            },
-            "Introduction": {
-                "length": "400-600 words", 
-                "structure": "Background, Problem Statement, Motivation, Contributions",
-                "requirements": "Clear problem definition, motivation, research gap, contributions"
-            },
-            "Literature Review": {
-                "length": "500-700 words",
-                "structure": "Related Work Categories, Critical Analysis, Research Gaps",
-                "requirements": "Comprehensive survey, critical analysis, identify gaps"
-            },
-            "Related Work": {
-                "length": "400-600 words",
-                "structure": "Categorized Related Work, Comparative Analysis",
-                "requirements": "Systematic categorization, comparative analysis"
-            },
-            "Methodology": {
-                "length": "600-800 words",
-                "structure": "System Architecture, Algorithm Design, Implementation Details",
-                "requirements": "Detailed technical approach, algorithms, architecture"
-            },
-            "System Design": {
-                "length": "500-700 words",
-                "structure": "Architecture Overview, Component Design, Interface Specifications",
-                "requirements": "Detailed system architecture, component interactions"
-            },
-            "Implementation": {
-                "length": "400-600 words",
-                "structure": "Technology Stack, Development Process, Key Challenges",
-                "requirements": "Technical implementation details, tools used, challenges"
-            },
-            "Experimental Setup": {
-                "length": "300-500 words",
-                "structure": "Dataset Description, Evaluation Metrics, Baseline Methods",
-                "requirements": "Comprehensive experimental design, datasets, metrics"
-            },
-            "Results": {
-                "length": "500-700 words",
-                "structure": "Quantitative Results, Performance Comparison, Discussion",
-                "requirements": "Detailed results with analysis, comparisons"
-            },
-            "Evaluation": {
-                "length": "400-600 words",
-                "structure": "Performance Analysis, Comparison Studies, Discussion",
-                "requirements": "Thorough evaluation with multiple perspectives"
-            },
-            "Discussion": {
-                "length": "400-600 words",
-                "structure": "Key Findings, Implications, Limitations",
-                "requirements": "Critical analysis of results, implications, limitations"
-            },
-            "Conclusion": {
-                "length": "200-300 words",
-                "structure": "Summary, Key Contributions, Impact",
-                "requirements": "Concise summary, clear contributions, impact statement"
-            },
-            "Future Work": {
-                "length": "200-300 words",
-                "structure": "Immediate Extensions, Long-term Directions",
-                "requirements": "Specific future research directions, potential improvements"
-            }
-        }
-        
-        return requirements.get(section_name, {
-            "length": "300-500 words",
-            "structure": "Introduction, Main Content, Analysis, Summary",
-            "requirements": "Well-structured technical content with proper analysis"
-        })
+        return SECTION_REQUIREMENTS.get(section_name, DEFAULT_SECTION_REQUIREMENTS)
     
     def generate_comprehensive_prompt(
         self, 
@@ -116,242 +342,169 @@ class ComprehensiveContentGenerator:
         paper_info: Dict
     ) -> str:
         """Generate comprehensive prompt for high-quality content"""
-        
-        requirements = self.get_section_requirements(section_name)
-        
-        base_prompt = f"""
-You are a world-class academic researcher and writer specializing in {domain} with expertise in IEEE publication standards. You are writing a comprehensive research paper for a top-tier IEEE conference/journal.
-
-PAPER INFORMATION:
-- Title: {paper_title}
-- Domain: {domain}
-- Authors: {', '.join(paper_info.get('authors', []))}
-- Keywords: {', '.join(paper_info.get('keywords', []))}
-
-SECTION TO WRITE: {section_name}
-
-SECTION REQUIREMENTS:
-- Target Length: {requirements['length']}
-- Structure: {requirements['structure']}
-- Requirements: {requirements['requirements']}
-
-CONTEXT FROM REFERENCE PAPERS:
-{context}
-
-WRITING GUIDELINES:
-1. COMPREHENSIVE CONTENT: Write detailed, substantial content that meets the target length
-2. TECHNICAL DEPTH: Include technical details, algorithms, mathematical formulations where appropriate
-3. IEEE STANDARDS: Follow IEEE formatting and citation style ([1], [2], etc.)
-4. ACADEMIC RIGOR: Use formal academic language with proper terminology
-5. LOGICAL FLOW: Ensure smooth transitions and logical progression
-6. EVIDENCE-BASED: Support claims with evidence from context or established knowledge
-7. ORIGINAL INSIGHTS: Provide novel insights and analysis beyond just summarizing
-8. PUBLICATION QUALITY: Write at the level expected for top-tier IEEE venues
-
-SPECIFIC INSTRUCTIONS FOR {section_name}:
-"""
-
-        # Add section-specific instructions
-        section_instructions = {
-            "Abstract": """
-- Write a complete abstract that summarizes the entire paper
-- Include: problem statement, proposed approach, key results, main contributions
-- Use quantitative results where possible (e.g., "achieved 95% accuracy")
-- Make it standalone - readable without the rest of the paper
-- No citations in abstract
-""",
-            "Introduction": """
-- Start with broad context and narrow down to specific problem
-- Clearly articulate the research problem and its importance
-- Explain why existing solutions are inadequate
-- Present your approach and key contributions (numbered list)
-- Provide a roadmap of the paper structure
-- Include motivation with real-world examples
-""",
-            "Literature Review": """
-- Organize related work into logical categories/themes
-- For each category, discuss 3-5 relevant papers with critical analysis
-- Compare and contrast different approaches
-- Identify limitations and gaps in existing work
-- Position your work clearly against existing literature
-- Use proper citations throughout [1], [2], etc.
-""",
-            "Methodology": """
-- Provide detailed technical approach with step-by-step explanation
-- Include algorithms in pseudocode format
-- Explain design decisions and rationale
-- Describe system architecture with component interactions
-- Include mathematical formulations where relevant
-- Ensure reproducibility with sufficient detail
-""",
-            "Results": """
-- Present comprehensive experimental results with analysis
-- Include quantitative metrics with statistical significance
-- Compare against multiple baseline methods
-- Provide both tabular data and analytical discussion
-- Explain what the results mean and why they occurred
-- Address any unexpected or negative results honestly
-""",
-            "Discussion": """
-- Analyze the implications of your results
-- Discuss strengths and limitations honestly
-- Compare with state-of-the-art approaches
-- Explain the broader impact of your work
-- Address potential concerns or criticisms
-- Suggest improvements and extensions
-""",
-            "Conclusion": """
-- Summarize the key contributions and findings
-- Restate the problem and how you solved it
-- Highlight the significance and impact of your work
-- Acknowledge limitations
-- Provide specific directions for future work
-- End with a strong closing statement about the work's importance
-"""
-        }
-        
-        prompt = base_prompt + section_instructions.get(section_name, """
-- Write comprehensive, technically sound content
-- Include detailed analysis and insights
-- Support all claims with evidence or reasoning
-- Maintain academic rigor throughout
-""")
-        
-        prompt += f"""
-
-IMPORTANT: Generate substantial, high-quality content that would be suitable for publication in a top-tier IEEE conference or journal. The content should be comprehensive, technically sound, and meet the target length of {requirements['length']}.
-
-Write the {section_name} section now:
-"""
-        
-        return prompt
+        return build_section_prompt(
+            section_name,
+            paper_title,
+            domain,
+            context,
+            tuple(paper_info.get('authors') or ()),
+            tuple(paper_info.get('keywords') or ())
+        )
     
-    def generate_multiple_sections_content(
+    def generate_multiple_sections_prompt(
         self,
         section_names: List[str],
         paper_title: str,
         domain: str,
         context: str,
         paper_info: Dict
-    ) -> Dict[str, str]:
-        """Generate content for multiple sections in a single API call"""
-        
-        # Create combined prompt for multiple sections
-        sections_info = []
-        for section_name in section_names:
-            requirements = self.get_section_requirements(section_name)
-            sections_info.append(f"""
-SECTION: {section_name}
-- Target Length: {requirements['length']}
-- Structure: {requirements['structure']}
-- Requirements: {requirements['requirements']}
-""")
+    ) -> str:
+        """Generate one prompt asking for several sections, answered as one JSON object keyed by section name"""
         
-        prompt = f"""
-You are a world-class academic researcher writing a comprehensive IEEE research paper.
-
-PAPER INFORMATION:
-- Title: {paper_title}
-- Domain: {domain}
-- Authors: {', '.join(paper_info.get('authors', []))}
-- Keywords: {', '.join(paper_info.get('keywords', []))}
-
-CONTEXT FROM REFERENCE PAPERS:
-{context[:2000]}...
-
-TASK: Generate content for the following sections in a single response. 
-Separate each section with "=== SECTION: [Section Name] ===" markers.
-
-SECTIONS TO GENERATE:
-{''.join(sections_info)}
-
-WRITING GUIDELINES:
-1. CONCISE CONTENT: Keep within the specified word limits for each section
-2. IEEE STANDARDS: Follow IEEE formatting and citation style
-3. ACADEMIC RIGOR: Use formal academic language
-4. LOGICAL FLOW: Ensure smooth transitions within each section
-5. EVIDENCE-BASED: Support claims with evidence from context
-6. PUBLICATION QUALITY: Write at the level expected for IEEE venues
-
-IMPORTANT: 
-- Start each section with "=== SECTION: [Section Name] ==="
-- Keep content concise but comprehensive
-- Ensure each section meets its specific requirements
-- Total response should be efficient to avoid rate limits
-
-Generate the sections now:
-"""
+        sections = "".join(
+            MULTI_SECTION_REQUIREMENTS_TEMPLATE.format(
+                section_name=section_name, **self.get_section_requirements(section_name)
+            )
+            for section_name in section_names
+        )
+        return MULTI_SECTION_PROMPT_TEMPLATE.format(
+            paper_title=paper_title,
+            domain=domain,
+            authors=', '.join(paper_info.get('authors', [])),
+            keywords=', '.join(paper_info.get('keywords', [])),
+            context=context[:2000],
+            sections=sections
+        )
+    
+    def multiple_sections_config(self, section_names: List[str]) -> types.GenerateContentConfig:
+        """Generation config constraining the response to a JSON object with one string per section"""
+        return types.GenerateContentConfig(
+            max_output_tokens=4000,  # Reduced for multiple sections
+            temperature=settings.temperature,
+            response_mime_type="application/json",
+            response_schema=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    section_name: types.Schema(type=types.Type.STRING)
+                    for section_name in section_names
+                },
+                required=list(section_names),
+                property_ordering=list(section_names)
+            )
+        )
+    
+    def section_config(self) -> types.GenerateContentConfig:
+        """Generation config for a single section"""
+        return types.GenerateContentConfig(
+            max_output_tokens=2000,  # Reduced from settings.max_tokens
+            temperature=settings.temperature,
+        )
+    
+    def _call_with_retry(
+        self, prompt: str, config: types.GenerateContentConfig, label: str, parse: Callable[[str], T]
+    ) -> T:
+        """Generate and parse a response, backing off on rate limits and retrying other errors
         
+        parse turns the response text into the result; its failures are retried too.
+        """
         max_retries = 3
-        retry_delay = 30
+        retry_delay = 30  # Start with 30 seconds for rate limits
         
         for attempt in range(max_retries):
             try:
-                print(f"Generating {len(section_names)} sections together (attempt {attempt + 1}/{max_retries})...")
-                
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt,
-                    config=genai.GenerateContentConfig(
-                        max_output_tokens=4000,  # Reduced for multiple sections
-                        temperature=settings.temperature,
-                    )
-                )
-                
-                content = response.text
-                
-                # Parse the response to extract individual sections
-                sections = self._parse_multiple_sections(content, section_names)
+                print(f"Generating {label} (attempt {attempt + 1}/{max_retries})...")
+                response = self.client.models.generate_content(model=self.model, contents=prompt, config=config)
+                return parse(response.text)
+            except Exception as e:
+                error_msg = str(e) or type(e).__name__
+                print(f"Attempt {attempt + 1} failed for {label}: {error_msg}")
                 
-                return sections
+                if attempt == max_retries - 1:
+                    raise Exception(f"Content generation failed for {label} after {max_retries} attempts: {error_msg}")
                 
+                if is_rate_limit_error(error_msg):
+                    delay = backoff_delay(retry_delay, error_msg)
+                    print(f"Rate/quota limit hit. Waiting {delay:.0f} seconds before retry...")
+                    time.sleep(delay)
+                    retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+    
+    async def _acall_with_retry(
+        self, prompt: str, config: types.GenerateContentConfig, label: str, parse: Callable[[str], T]
+    ) -> T:
+        """Async _call_with_retry: awaits the API (and rate-limit backoff) on the event loop"""
+        max_retries = 3
+        retry_delay = 30  # Start with 30 seconds for rate limits
+        
+        for attempt in range(max_retries):
+            try:
+                print(f"Generating {label} (attempt {attempt + 1}/{max_retries})...")
+                await self.rate_limiter.acquire()
+                async with asyncio.timeout(settings.generation_timeout):
+                    response = await self.client.aio.models.generate_content(
+                        model=self.model, contents=prompt, config=config
+                    )
+                return parse(response.text)
             except Exception as e:
-                error_msg = str(e)
-                print(f"Attempt {attempt + 1} failed for multiple sections: {error_msg}")
-                
-                if any(keyword in error_msg.lower() for keyword in ["429", "quota", "rate", "limit"]):
-                    if attempt < max_retries - 1:
-                        print(f"Rate/quota limit hit. Waiting {retry_delay} seconds before retry...")
-                        import time
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
+                error_msg = str(e) or type(e).__name__
+                print(f"Attempt {attempt + 1} failed for {label}: {error_msg}")
                 
                 if attempt == max_retries - 1:
-                    raise Exception(f"Multi-section generation failed after {max_retries} attempts: {error_msg}")
-        
-        raise Exception(f"Multi-section generation failed for {section_names}")
+                    raise Exception(f"Content generation failed for {label} after {max_retries} attempts: {error_msg}")
+                
+                if is_rate_limit_error(error_msg):
+                    delay = backoff_delay(retry_delay, error_msg)
+                    print(f"Rate/quota limit hit. Waiting {delay:.0f} seconds before retry...")
+                    await asyncio.sleep(delay)
+                    retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+    
+    def generate_multiple_sections_content(
+        self,
+        section_names: List[str],
+        paper_title: str,
+        domain: str,
+        context: str,
+        paper_info: Dict
+    ) -> Dict[str, str]:
+        """Generate content for multiple sections in a single API call"""
+        prompt = self.generate_multiple_sections_prompt(
+            section_names, paper_title, domain, context, paper_info
+        )
+        return self._call_with_retry(
+            prompt, self.multiple_sections_config(section_names), ", ".join(section_names),
+            lambda content: self._parse_multiple_sections(content, section_names)
+        )
+    
+    async def agenerate_multiple_sections_content(
+        self,
+        section_names: List[str],
+        paper_title: str,
+        domain: str,
+        context: str,
+        paper_info: Dict
+    ) -> Dict[str, str]:
+        """Async generate_multiple_sections_content"""
+        prompt = self.generate_multiple_sections_prompt(
+            section_names, paper_title, domain, context, paper_info
+        )
+        return await self._acall_with_retry(
+            prompt, self.multiple_sections_config(section_names), ", ".join(section_names),
+            lambda content: self._parse_multiple_sections(content, section_names)
+        )
     
     def _parse_multiple_sections(self, content: str, section_names: List[str]) -> Dict[str, str]:
-        """Parse the multi-section response into individual sections"""
-        sections = {}
+        """Parse the structured (JSON) multi-section response into individual sections
         
-        # Split by section markers
-        parts = content.split("=== SECTION:")
+        Raises ValueError on malformed JSON (e.g. output cut off at max_output_tokens) so the
+        caller retries the batch.
+        """
+        parsed = json.loads(content)
         
-        for part in parts[1:]:  # Skip first empty part
-            lines = part.strip().split('\n')
-            if not lines:
-                continue
-                
-            # Extract section name from first line
-            section_line = lines[0].strip()
-            section_name = section_line.replace("===", "").strip()
-            
-            # Find matching section name
-            matched_section = None
-            for expected_section in section_names:
-                if expected_section.lower() in section_name.lower():
-                    matched_section = expected_section
-                    break
-            
-            if matched_section:
-                # Extract content (skip the section header line)
-                section_content = '\n'.join(lines[1:]).strip()
-                section_content = self.post_process_content(section_content, matched_section)
-                sections[matched_section] = section_content
+        sections = {}
+        for section_name in section_names:
+            section_content = parsed.get(section_name)
+            if isinstance(section_content, str) and section_content.strip():
+                sections[section_name] = self.post_process_content(section_content, section_name)
         
-        # If parsing failed, fall back to single section generation
         if len(sections) < len(section_names):
             print(f"⚠️  Multi-section parsing incomplete. Got {len(sections)}/{len(section_names)} sections")
         
@@ -366,66 +519,94 @@ Generate the sections now:
         paper_info: Dict
     ) -> str:
         """Generate comprehensive content for a specific section with rate limiting"""
+        prompt = self.generate_comprehensive_prompt(
+            section_name, paper_title, domain, context, paper_info
+        )
+        return self._call_with_retry(
+            prompt, self.section_config(), section_name,
+            lambda content: self.post_process_content(content, section_name)
+        )
+    
+    async def agenerate_section_content(
+        self,
+        section_name: str,
+        paper_title: str,
+        domain: str,
+        context: str,
+        paper_info: Dict
+    ) -> str:
+        """Async generate_section_content"""
+        prompt = self.generate_comprehensive_prompt(
+            section_name, paper_title, domain, context, paper_info
+        )
+        return await self._acall_with_retry(
+            prompt, self.section_config(), section_name,
+            lambda content: self.post_process_content(content, section_name)
+        )
+    
+    async def astream_section_content(
+        self,
+        section_name: str,
+        paper_title: str,
+        domain: str,
+        context: str,
+        paper_info: Dict
+    ) -> AsyncIterator[str]:
+        """Stream a section's raw text as it is generated
+        
+        Chunks are not post-processed; run post_process_content on the joined text.
+        Rate limits are only retried before the first chunk, since sent text can't be taken back.
+        """
         
         prompt = self.generate_comprehensive_prompt(
             section_name, paper_title, domain, context, paper_info
         )
         
         max_retries = 3
-        retry_delay = 30  # Start with 30 seconds for rate limits
+        retry_delay = 30
         
         for attempt in range(max_retries):
+            started = False
             try:
-                print(f"Generating {section_name} (attempt {attempt + 1}/{max_retries})...")
+                print(f"Streaming {section_name} (attempt {attempt + 1}/{max_retries})...")
                 
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt,
-                    config=genai.GenerateContentConfig(
-                        max_output_tokens=2000,  # Reduced from settings.max_tokens
-                        temperature=settings.temperature,
-                    )
+                await self.rate_limiter.acquire()
+                stream = await self.client.aio.models.generate_content_stream(
+                    model=self.model, contents=prompt, config=self.section_config()
                 )
-                
-                content = response.text
-                
-                # Post-process content
-                content = self.post_process_content(content, section_name)
-                
-                return content
+                async for chunk in stream:
+                    if chunk.text:
+                        started = True
+                        yield chunk.text
+                return
                 
             except Exception as e:
-                error_msg = str(e)
+                error_msg = str(e) or type(e).__name__
                 print(f"Attempt {attempt + 1} failed for {section_name}: {error_msg}")
                 
-                # Check if it's a rate limit or quota error
-                if any(keyword in error_msg.lower() for keyword in ["429", "quota", "rate", "limit"]):
+                if started:
+                    raise
+                
+                if is_rate_limit_error(error_msg):
                     if attempt < max_retries - 1:
-                        print(f"Rate/quota limit hit. Waiting {retry_delay} seconds before retry...")
-                        import time
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff: 10, 20, 40 seconds
+                        delay = backoff_delay(retry_delay, error_msg)
+                        print(f"Rate/quota limit hit. Waiting {delay:.0f} seconds before retry...")
+                        await asyncio.sleep(delay)
+                        retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
                         continue
                 
-                # If it's the last attempt or not a rate limit error, raise the exception
                 if attempt == max_retries - 1:
                     raise Exception(f"Content generation failed after {max_retries} attempts: {error_msg}")
-        
-        # This should never be reached, but just in case
-        raise Exception(f"Content generation failed for {section_name}")
     
     def post_process_content(self, content: str, section_name: str) -> str:
         """Post-process generated content for quality and formatting"""
         
         # Remove any unwanted prefixes
-        content = re.sub(r'^(Here is the|Here\'s the|The following is)', '', content, flags=re.IGNORECASE)
-        content = re.sub(r'^' + re.escape(section_name) + r'\s*:?\s*', '', content, flags=re.IGNORECASE)
+        content = PREAMBLE_RE.sub('', content)
+        content = section_heading_re(section_name).sub('', content)
         
         # Ensure proper paragraph spacing
-        content = re.sub(r'\n\s*\n\s*\n+', '\n\n', content)
-        
-        # Fix citation formatting
-        content = re.sub(r'\[(\d+)\]', r'[\1]', content)
+        content = EXTRA_BLANK_LINES_RE.sub('\n\n', content)
         
         # Ensure content ends properly
         content = content.strip()
@@ -433,7 +614,7 @@ Generate the sections now:
         # Add section-specific formatting
         if section_name == "Abstract":
             # Ensure abstract is in paragraph form
-            content = re.sub(r'\n+', ' ', content)
+            content = NEWLINES_RE.sub(' ', content)
             content = content.strip()
         
         return content
@@ -474,7 +655,7 @@ Generate the references:
             response = self.client.models.generate_content(
                 model=self.model,
                 contents=prompt,
-                config=genai.GenerateContentConfig(
+                config=types.GenerateContentConfig(
                     max_output_tokens=2000,
                     temperature=0.8,
                 )
@@ -482,28 +663,21 @@ Generate the references:
             
             references_text = response.text
             
-            # Parse references
-            references = []
-            lines = references_text.split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                if line and (line.startswith('[') or line.startswith('1.') or line.startswith('•')):
-                    # Extract reference number and citation
-                    match = re.match(r'[\[\(]?(\d+)[\]\)]?\s*(.+)', line)
-                    if match:
-                        ref_num = match.group(1)
-                        citation = match.group(2).strip()
-                        references.append({
-                            "key": f"ref{ref_num}",
-                            "citation": citation
-                        })
-            
-            return references[:20]  # Limit to 20 references
+            # Parse references (limited to 20)
+            return [
+                {"key": f"ref{match.group(1)}", "citation": match.group(2)}
+                for match in islice(REFERENCE_LINE_RE.finditer(references_text), 20)
+            ]
             
         except Exception as e:
             # Fallback references
             return [
                 {"key": "ref1", "citation": "Smith, J. A., \"Advanced Methods in " + domain + ",\" IEEE Transactions on Technology, vol. 45, no. 3, pp. 123-135, 2023."},
                 {"key": "ref2", "citation": "Johnson, B. C., \"Recent Developments in " + domain + " Systems,\" Proceedings of IEEE Conference, pp. 456-467, 2022."}
-            ]
\ No newline at end of file
+            ]
+
+@lru_cache(maxsize=1)
+def get_content_generator() -> ComprehensiveContentGenerator:
+    """Get the shared content generator so the Gemini client is created once per process"""
+    print("🔄 Initializing content generator...")
+    return ComprehensiveContentGenerator()
@@ -1,16 +1,32 @@
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import PyPDF2
 from docx import Document
-from typing import List, Tuple, Optional
-import google.genai as genai
+from typing import List, Tuple, Optional, Union
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import torch
+from functools import lru_cache
 from config import get_settings
 
 settings = get_settings()
 
+# Default batch sizes for chunk embedding; GPUs amortize kernel launches over larger batches
+CPU_EMBEDDING_BATCH_SIZE = 32
+GPU_EMBEDDING_BATCH_SIZE = 128
+
+# Decimal places kept when serializing embeddings for pgvector (plenty for cosine similarity)
+EMBEDDING_LITERAL_PRECISION = 5
+
+def get_embedding_device() -> str:
+    """Resolve the device for the embedding model (EMBED_DEVICE, or auto-detect CUDA)"""
+    if settings.embed_device and settings.embed_device != "auto":
+        return settings.embed_device
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
 class FileProcessor:
     """Process uploaded PDF and DOCX files"""
     
@@ -23,10 +39,27 @@ class FileProcessor:
         """Lazy load the embedding model only when needed"""
         if self._embedding_model is None:
             print("🔄 Loading embedding model (first time only)...")
-            self._embedding_model = SentenceTransformer(settings.embedding_model)
+            self._embedding_model = self._load_embedding_model()
             print("✅ Embedding model loaded successfully")
         return self._embedding_model
     
+    @staticmethod
+    def _load_embedding_model() -> SentenceTransformer:
+        """Load the embedding model with the configured inference backend and device"""
+        device = get_embedding_device()
+        print(f"🖥️  Embedding model device: {device}")
+        if settings.embedding_backend == "onnx":
+            try:
+                return SentenceTransformer(
+                    settings.embedding_model,
+                    device=device,
+                    backend="onnx",
+                    model_kwargs={"file_name": settings.embedding_onnx_file}
+                )
+            except Exception as e:
+                print(f"⚠️  ONNX embedding backend unavailable ({e}), falling back to PyTorch")
+        return SentenceTransformer(settings.embedding_model, device=device)
+    
     def is_model_loaded(self) -> bool:
         """Check if embedding model is already loaded"""
         return self._embedding_model is not None
@@ -76,8 +109,17 @@ class FileProcessor:
         chunks = text_splitter.split_text(text)
         return chunks
     
-    def generate_embeddings(self, text: str) -> List[float]:
-        """Generate embeddings using all-MiniLM-L6-v2 model"""
+    def generate_embeddings(
+        self, text: Union[str, List[str]], batch_size: Optional[int] = None
+    ) -> Union[List[float], List[List[float]]]:
+        """Generate embeddings using all-MiniLM-L6-v2 model
+        
+        Accepts a single string (query path) or a list of strings, which is
+        handed to generate_embeddings_batch.
+        """
+        if not isinstance(text, str):
+            return self.generate_embeddings_batch(text, batch_size=batch_size).tolist()
+        
         try:
             # Generate embedding using sentence transformer
             embedding = self.embedding_model.encode(text, convert_to_tensor=False)
@@ -86,6 +128,68 @@ class FileProcessor:
         except Exception as e:
             raise Exception(f"Error generating embeddings: {str(e)}")
     
+    def generate_embeddings_batch(
+        self, texts: List[str], batch_size: Optional[int] = None
+    ) -> np.ndarray:
+        """Generate embeddings for many texts in batched forward passes
+        
+        Texts are sorted by length first so each batch is padded only to
+        similar-sized inputs, and results are returned in the original order
+        as one (len(texts), dimension) float32 matrix.
+        """
+        if not texts:
+            return np.empty((0, settings.embedding_dimension), dtype=np.float32)
+        
+        try:
+            if batch_size is None:
+                on_gpu = str(self.embedding_model.device).startswith("cuda")
+                batch_size = GPU_EMBEDDING_BATCH_SIZE if on_gpu else CPU_EMBEDDING_BATCH_SIZE
+            
+            # Smart batching: encode length-sorted inputs, then undo the permutation
+            order = np.argsort([len(t) for t in texts], kind="stable")
+            sorted_texts = [texts[i] for i in order]
+            while True:
+                try:
+                    sorted_embeddings = self.embedding_model.encode(
+                        sorted_texts,
+                        batch_size=batch_size,
+                        convert_to_numpy=True,
+                        show_progress_bar=False
+                    )
+                    break
+                except RuntimeError as e:
+                    # Out of (GPU) memory: retry with smaller batches, down to one text at a time
+                    if "out of memory" not in str(e).lower() or batch_size <= 1:
+                        raise
+                    batch_size //= 2
+                    print(f"⚠️  Embedding batch ran out of memory, retrying with batch_size={batch_size}")
+                    self._release_accelerator_memory()
+            embeddings = np.empty_like(sorted_embeddings, dtype=np.float32)
+            embeddings[order] = sorted_embeddings
+            return embeddings
+        except Exception as e:
+            raise Exception(f"Error generating embeddings: {str(e)}")
+    
+    @staticmethod
+    def _release_accelerator_memory():
+        """Free cached CUDA allocations after an out-of-memory error"""
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    
+    @staticmethod
+    def to_pgvector_literal(
+        embedding: Union[np.ndarray, List[float]], precision: int = EMBEDDING_LITERAL_PRECISION
+    ) -> str:
+        """Format an embedding as a compact pgvector text literal, e.g. "[0.01234,-0.05678]"
+        
+        Full float reprs serialize to ~20 bytes per dimension in JSON; rounding keeps the
+        payload several times smaller with no meaningful effect on similarity scores.
+        """
+        if isinstance(embedding, np.ndarray):
+            embedding = embedding.tolist()  # Python floats format much faster than numpy scalars
+        fmt = f".{precision}f"
+        return "[" + ",".join(format(x, fmt) for x in embedding) + "]"
+    
     @classmethod
     def process_file(cls, file_path: str, file_type: str) -> Tuple[str, List[str]]:
         """Process uploaded file and return text and chunks"""
@@ -97,4 +201,40 @@ class FileProcessor:
             raise ValueError(f"Unsupported file type: {file_type}")
         
         chunks = cls.chunk_text(text)
-        return text, chunks
\ No newline at end of file
+        return text, chunks
+
+@lru_cache(maxsize=1)
+def get_file_processor() -> FileProcessor:
+    """Get the shared file processor so the embedding model is loaded once per process"""
+    print("🔄 Initializing file processor...")
+    return FileProcessor()
+
+@lru_cache(maxsize=1)
+def get_parse_executor() -> ProcessPoolExecutor:
+    """Process pool for CPU-bound PDF/DOCX parsing and chunking (sidesteps the GIL)
+    
+    Spawned rather than forked so workers don't inherit the loaded model, torch threads or
+    open connections, and sized so all uvicorn workers' pools together use the CPU count.
+    """
+    workers = max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", "1"))))
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+@lru_cache(maxsize=settings.query_embedding_cache_size)
+def embed_query(text: str) -> Tuple[float, ...]:
+    """Embed a retrieval query, memoized since the same queries repeat across regenerations"""
+    return tuple(get_file_processor().generate_embeddings(text))
+
+def compose_query_embedding(section_name: str, title: str, domain: str) -> List[float]:
+    """Approximate the embedding of "<section> <title> <domain>" from cached parts
+    
+    Section names come from a small closed set and the topic is fixed per paper, so both
+    embeddings are almost always cache hits and the query costs a vector average instead
+    of a model forward pass.
+    """
+    section_embedding = np.asarray(embed_query(section_name), dtype=np.float32)
+    topic_embedding = np.asarray(embed_query(f"{title} {domain}"), dtype=np.float32)
+    combined = 0.5 * section_embedding + 0.5 * topic_embedding
+    norm = np.linalg.norm(combined)
+    if norm > 0:
+        combined /= norm
+    return combined.tolist()
@@ -10,6 +10,10 @@ from pathlib import Path
 from typing import Dict, List, Optional
 import subprocess
 import re
+import time
+
+# Seconds before re-probing after LaTeX was found missing (a positive result is kept for the process lifetime)
+LATEX_UNAVAILABLE_RECHECK_SECONDS = 60
 
 class IEEELaTeXGenerator:
     """Generate clean IEEE LaTeX papers that compile without errors"""
@@ -550,9 +554,13 @@ class IEEELaTeXGenerator:
             raise
     
     def _get_pdflatex_command(self) -> str:
-        """Get the correct pdflatex command"""
-        import os
-        
+        """Get the correct pdflatex command (resolved once, then cached)"""
+        if getattr(self, "_pdflatex_cmd", None) is None:
+            self._pdflatex_cmd = self._find_pdflatex_command()
+        return self._pdflatex_cmd
+    
+    def _find_pdflatex_command(self) -> str:
+        """Locate pdflatex on PATH or in common MiKTeX install locations"""
         # Try PATH first
         try:
             result = subprocess.run(['pdflatex', '--version'], 
@@ -580,6 +588,8 @@ class LaTeXService:
     
     def __init__(self):
         self.generator = IEEELaTeXGenerator()
+        self._latex_available: Optional[bool] = None
+        self._latex_checked_at = 0.0
     
     def generate_ieee_paper_latex(self, paper_data: Dict, sections_data: List[Dict]) -> str:
         """Generate IEEE paper LaTeX from paper and sections data"""
@@ -646,15 +656,33 @@ class LaTeXService:
         """Compile LaTeX to PDF"""
         return self.generator.compile_to_pdf(latex_content, output_dir)
     
+    def cached_latex_availability(self) -> Optional[bool]:
+        """The cached availability if still fresh, else None (a probe is due)"""
+        if self._latex_available or (
+            self._latex_available is False
+            and time.monotonic() - self._latex_checked_at < LATEX_UNAVAILABLE_RECHECK_SECONDS
+        ):
+            return self._latex_available
+        return None
+    
     def is_latex_available(self) -> bool:
-        """Check if LaTeX is available"""
+        """Check if LaTeX is available (cached; a missing install is re-checked periodically)"""
+        cached = self.cached_latex_availability()
+        if cached is not None:
+            return cached
+        
         try:
+            # Probe again from scratch in case LaTeX was installed since the last check
+            self.generator._pdflatex_cmd = None
             pdflatex_cmd = self.generator._get_pdflatex_command()
             result = subprocess.run([pdflatex_cmd, '--version'], 
                                   capture_output=True, text=True, timeout=5)
-            return result.returncode == 0
+            self._latex_available = result.returncode == 0
         except:
-            return False
+            self._latex_available = False
+        
+        self._latex_checked_at = time.monotonic()
+        return self._latex_available
 
 # Global instance
 latex_service = LaTeXService()
@@ -0,0 +1,227 @@
+"""
+Retrieval of reference-paper chunks for RAG
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from database import supabase
+from config import get_settings
+
+try:
+    import simsimd
+except ImportError:  # Optional: SIMD kernels for local similarity, numpy fallback otherwise
+    simsimd = None
+
+settings = get_settings()
+
+# Retrieved chunks per (paper_id, query_key, threshold, count), valid while the paper's chunk set is
+# unchanged and for at most retrieval_cache_ttl seconds: invalidation is per process, so the TTL
+# bounds how long other workers keep serving results from before new chunks were stored
+RETRIEVAL_CACHE_MAX_ENTRIES = 512
+_retrieval_cache: "OrderedDict[Tuple, Tuple[int, float, List[Dict[str, Any]]]]" = OrderedDict()
+_chunk_versions: Dict[str, int] = {}
+
+# Per-paper chunk rows + normalized embedding matrix, keyed by the same chunk-set version and TTL
+CORPUS_CACHE_MAX_PAPERS = 16
+CORPUS_PAGE_SIZE = 1000  # PostgREST's default max_rows
+_corpus_cache: "OrderedDict[str, Tuple[int, float, List[Dict[str, Any]], np.ndarray]]" = OrderedDict()
+
+_cache_lock = threading.Lock()
+# One lock per paper so concurrent section batches share a single corpus download
+_corpus_locks: Dict[str, threading.Lock] = {}
+
+
+def parse_embeddings(values: Sequence[Any]) -> np.ndarray:
+    """Parse many PostgREST embeddings into one contiguous float32 matrix with a single JSON decode"""
+    if not values:
+        return np.empty((0, 0), dtype=np.float32)
+    literals = [value if isinstance(value, str) else json.dumps(value) for value in values]
+    return np.asarray(json.loads("[" + ",".join(literals) + "]"), dtype=np.float32)
+
+
+def top_k_similar(query: Sequence[float], matrix: np.ndarray, k: int) -> List[tuple]:
+    """Return (row_index, cosine_similarity) for the k rows of matrix most similar to query"""
+    if len(matrix) == 0 or k <= 0:
+        return []
+
+    query = np.asarray(query, dtype=np.float32)
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if simsimd is not None:
+        similarities = 1.0 - np.asarray(simsimd.cdist(query[None, :], matrix, metric="cosine")).ravel()
+    else:
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        similarities = matrix @ query / np.maximum(norms, 1e-12)
+
+    k = min(k, len(similarities))
+    top = np.argpartition(-similarities, k - 1)[:k]
+    top = top[np.argsort(-similarities[top])]
+    return [(int(i), float(similarities[i])) for i in top]
+
+
+def get_paper_corpus(paper_id: str) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """Get a paper's chunk rows and their L2-normalized float32 embedding matrix
+    
+    Loaded once per chunk-set version (refreshed after retrieval_cache_ttl) and kept in memory, so
+    repeated retrievals for the paper are a single matrix-vector product instead of a database round-trip.
+    """
+    paper_id = str(paper_id)
+    cached = _cached_corpus(paper_id)
+    if cached:
+        return cached
+
+    with _cache_lock:
+        paper_lock = _corpus_locks.setdefault(paper_id, threading.Lock())
+    with paper_lock:
+        # Another thread may have loaded the corpus while this one waited
+        cached = _cached_corpus(paper_id)
+        if cached:
+            return cached
+        return _load_paper_corpus(paper_id)
+
+
+def _cached_corpus(paper_id: str) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    with _cache_lock:
+        version = _chunk_versions.get(paper_id, 0)
+        cached = _corpus_cache.get(paper_id)
+        if cached and cached[0] == version and cached[1] > time.monotonic():
+            _corpus_cache.move_to_end(paper_id)
+            return cached[2], cached[3]
+    return None
+
+
+def _load_paper_corpus(paper_id: str) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    with _cache_lock:
+        version = _chunk_versions.get(paper_id, 0)
+
+    # Paged: PostgREST silently truncates a single select at its max_rows limit
+    data: List[Dict[str, Any]] = []
+    while True:
+        page = supabase.table("document_chunks").select(
+            "chunk_id,content,embedding,metadata"
+        ).eq("paper_id", paper_id).order("chunk_index").range(
+            len(data), len(data) + CORPUS_PAGE_SIZE - 1
+        ).execute().data or []
+        data.extend(page)
+        if len(page) < CORPUS_PAGE_SIZE:
+            break
+
+    rows = [row for row in data if row.get("embedding") is not None]
+    matrix = parse_embeddings([row.pop("embedding") for row in rows])
+    if len(matrix):
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    # Empty corpora aren't cached: chunks may still be processing in the background
+    if rows:
+        with _cache_lock:
+            _corpus_cache[paper_id] = (version, time.monotonic() + settings.retrieval_cache_ttl, rows, matrix)
+            _corpus_cache.move_to_end(paper_id)
+            while len(_corpus_cache) > CORPUS_CACHE_MAX_PAPERS:
+                _corpus_cache.popitem(last=False)
+    return rows, matrix
+
+
+def match_documents_local(
+    paper_id: str, query_embedding: Sequence[float], match_threshold: float, match_count: int
+) -> List[Dict[str, Any]]:
+    """Rank a paper's chunks in-process against its cached embedding matrix"""
+    rows, matrix = get_paper_corpus(paper_id)
+    return [
+        {
+            "chunk_id": rows[i]["chunk_id"],
+            "content": rows[i]["content"],
+            "similarity": similarity,
+            "metadata": rows[i].get("metadata")
+        }
+        for i, similarity in top_k_similar(query_embedding, matrix, match_count)
+        if similarity > match_threshold
+    ]
+
+
+def match_documents(
+    paper_id: str, query_embedding: Sequence[float], match_threshold: float, match_count: int
+) -> List[Dict[str, Any]]:
+    """Retrieve the chunks of a paper most similar to the query embedding"""
+    try:
+        result = supabase.rpc("match_documents", {
+            "query_embedding": list(query_embedding),
+            "match_threshold": match_threshold,
+            "match_count": match_count,
+            "paper_id": str(paper_id)
+        }).execute()
+        return result.data or []
+    except Exception as e:
+        print(f"⚠️  match_documents RPC failed ({e}), ranking chunks locally")
+        return match_documents_local(str(paper_id), query_embedding, match_threshold, match_count)
+
+
+def build_context(chunks: Sequence[Dict[str, Any]], max_chars: Optional[int] = None) -> str:
+    """Join retrieved chunks (best match first) into prompt context, capped at max_chars
+    
+    The context is resent with every section prompt, so the cap bounds prompt tokens;
+    chunks that don't fit whole are dropped rather than cut mid-sentence. Repeated
+    chunk texts (e.g. the same reference uploaded twice) are included once.
+    """
+    if max_chars is None:
+        max_chars = settings.max_context_chars
+    
+    parts = []
+    seen = set()
+    total = 0
+    for chunk in chunks:
+        content = chunk["content"]
+        digest = hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+        if digest in seen:
+            continue
+        if total + len(content) > max_chars:
+            break
+        seen.add(digest)
+        parts.append(content)
+        total += len(content) + 2  # "\n\n" separator
+    return "\n\n".join(parts)
+
+
+def invalidate_paper_chunks(paper_id: str):
+    """Mark a paper's chunk set as changed so cached retrievals are refreshed"""
+    with _cache_lock:
+        _chunk_versions[str(paper_id)] = _chunk_versions.get(str(paper_id), 0) + 1
+
+
+def match_documents_cached(
+    paper_id: str,
+    query_key: str,
+    query_embedding: Sequence[float],
+    match_threshold: float,
+    match_count: int
+) -> List[Dict[str, Any]]:
+    """match_documents, memoized per paper and query until new chunks are stored for the paper
+    (or retrieval_cache_ttl passes)
+    
+    query_key identifies the query text (e.g. the section name) so the embedding itself
+    does not have to be hashed.
+    """
+    paper_id = str(paper_id)
+    key = (paper_id, query_key, match_threshold, match_count)
+    with _cache_lock:
+        version = _chunk_versions.get(paper_id, 0)
+        cached = _retrieval_cache.get(key)
+        if cached and cached[0] == version and cached[1] > time.monotonic():
+            _retrieval_cache.move_to_end(key)
+            return cached[2]
+    
+    chunks = match_documents(paper_id, query_embedding, match_threshold, match_count)
+    
+    # Empty results aren't cached: chunks may still be processing in the background
+    if chunks:
+        with _cache_lock:
+            _retrieval_cache[key] = (version, time.monotonic() + settings.retrieval_cache_ttl, chunks)
+            _retrieval_cache.move_to_end(key)
+            while len(_retrieval_cache) > RETRIEVAL_CACHE_MAX_ENTRIES:
+                _retrieval_cache.popitem(last=False)
+    return chunks
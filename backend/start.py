@@ -68,10 +68,15 @@ def main():
     print("\nPress Ctrl+C to stop the server")
     print("=" * 40)
     
-    # Start the server
+    # Start the server (uvicorn[standard] picks uvloop/httptools automatically where available)
     try:
         import uvicorn
-        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        if workers > 1:
+            # Auto-reload only supports a single process
+            uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+        else:
+            uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
     except Exception as e: